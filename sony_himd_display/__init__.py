@@ -1,2 +1,8 @@
-from .pd import Decoder
-
+try:
+    import sigrokdecode
+except ImportError:
+    # Imported outside of libsigrokdecode (the emulator, command line tools) - only the
+    # standalone modules are usable then.
+    pass
+else:
+    from .pd import Decoder
@@ -0,0 +1,133 @@
+from collections import defaultdict
+import tracemalloc
+import json
+import time
+import sys
+
+from .core import DecoderCore, decode_stream
+from .state import State, StateHistory, apply_event
+from .synth import SessionGenerator, iter_samples
+
+# Benchmarks for the decoder and the emulator's state engine, on synthetic captures.
+# Every result is a "higher is better" rate, so that runs can be compared against each other.
+
+def best_of(repeats, fn):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_decoder(samples, byte_count, repeats):
+    results = {}
+    def ignore(*_):
+        pass
+    for parser in ('byte', 'packet'):
+        for annotated in (False, True):
+            def run():
+                core = DecoderCore(annotate = ignore if annotated else None, packet_mode = parser == 'packet')
+                for _ in decode_stream(samples, core):
+                    pass
+            elapsed = best_of(repeats, run)
+            results[f"decoder.{parser}{'.annotated' if annotated else ''}.bytes_per_sec"] = byte_count / elapsed
+    return results
+
+def collect_commands(samples):
+    commands = defaultdict(list)
+    events = []
+    for record in decode_stream(samples, packet_mode = True):
+        commands[record.opcode].append(record.data)
+        events += record.events
+    return commands, events
+
+def bench_handlers(commands, repeats, per_opcode = 200):
+    results = {}
+    core = DecoderCore(annotate = lambda *_: None)
+    for opcode, datas in sorted(commands.items()):
+        info = core.command_table[opcode]
+        if not info:
+            continue
+        datas = datas[:per_opcode]
+        def run():
+            for data in datas:
+                info.handler(core, data)
+        elapsed = best_of(repeats, run)
+        results[f"handler.{opcode:02x}.calls_per_sec"] = len(datas) / elapsed
+    return results
+
+def bench_state_engine(events, repeats):
+    def run():
+        state = State()
+        history = StateHistory()
+        for event in events:
+            state = apply_event(state, event)
+            history.append(event, state)
+    elapsed = best_of(repeats, run)
+    results = {"emulator.handle_event.events_per_sec": len(events) / elapsed}
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    state = State()
+    history = StateHistory()
+    for event in events:
+        state = apply_event(state, event)
+        history.append(event, state)
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    # Reported as events per kilobyte to keep "higher is better"
+    results["emulator.history.events_per_kb"] = len(events) / (used / 1024)
+
+    start = time.perf_counter()
+    for i in range(0, len(history), max(len(history) // 1000, 1)):
+        history[len(history) - 1 - i]
+    results["emulator.history.seeks_per_sec"] = min(1000, len(history)) / (time.perf_counter() - start)
+    return results
+
+def run_benchmarks(packets, seed, repeats):
+    data = SessionGenerator(seed).capture(packets)
+    samples = list(iter_samples(data))
+    results = {}
+    results.update(bench_decoder(samples, len(data), repeats))
+    commands, events = collect_commands(samples)
+    results.update(bench_handlers(commands, repeats))
+    results.update(bench_state_engine(events, repeats))
+    return results
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, value in results.items():
+        if name in baseline and value < baseline[name] * (1 - tolerance):
+            regressions.append((name, baseline[name], value))
+    return regressions
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the decoder and the emulator state engine on a synthetic capture")
+    parser.add_argument("--packets", type=int, default=5000, help="Number of data packets to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3, help="Best of how many runs")
+    parser.add_argument("--json", default=None, help="Write the results to this file")
+    parser.add_argument("--compare", default=None, help="Results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed slowdown against --compare")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.packets, args.seed, args.repeats)
+    width = max(len(x) for x in results)
+    for name, value in results.items():
+        print(f"{name:<{width}}  {value:14.1f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after in regressions:
+            print(f"REGRESSION: {name} {before:.1f} => {after:.1f} ({after / before - 1:+.1%})")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+from dataclasses import dataclass, field
+from collections import defaultdict
+from typing import List
+
+from .core import DecoderCore, iter_spi_file
+
+# Compares the command streams of two captures. Both are decoded, every command (or packet) is reduced
+# to a fingerprint - a hash of its bytes - and the fingerprint sequences are aligned with Myers' diff,
+# in linear space. The time is O((N + M) * D) for D differences, so nearly identical multi-hour
+# captures are aligned about as fast as they are decoded.
+
+@dataclass
+class Unit:
+    # A command, or the commands of a packet
+    opcodes: List[int]
+    start: int
+    end: int
+    data: bytes
+    descriptions: List[str] = field(default_factory=list)
+
+    def describe(self):
+        return '; '.join(x for x in self.descriptions if x) or self.data.hex(' ')
+
+def decode_units(path, per_packet = False, ignore = (), collapse_repeats = False):
+    core = DecoderCore(packet_mode = True, collapse_repeats = collapse_repeats, describe = True)
+    units = []
+    feed = core.feed
+    for start, end, value in iter_spi_file(path):
+        records = feed(start, end, value)
+        if not records:
+            continue
+        records = [x for x in records if x.opcode not in ignore]
+        if not records:
+            continue
+        if per_packet:
+            units.append(Unit(
+                [x.opcode for x in records], records[0].start, records[-1].end,
+                b''.join(x.data for x in records), [x.description for x in records],
+            ))
+        else:
+            units.extend(Unit([x.opcode], x.start, x.end, x.data, [x.description]) for x in records)
+    return units
+
+def fingerprints(units):
+    # hash() of bytes is cached on the object, so equal commands cost one comparison of ints
+    return [hash(x.data) for x in units]
+
+def middle_snake(a, a_lo, a_hi, b, b_lo, b_hi):
+    # Myers' middle snake: (x, y, u, v) - the diagonal run (x, y) => (u, v) which the shortest edit
+    # script of the two ranges goes through halfway
+    n, m = a_hi - a_lo, b_hi - b_lo
+    delta = n - m
+    odd = delta & 1
+    offset = n + m + 1
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+    for d in range((n + m + 1) // 2 + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            if odd and -(d - 1) <= delta - k <= d - 1 and x + backward[offset + delta - k] >= n:
+                return a_lo + x0, b_lo + y0, a_lo + x, b_lo + y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a_hi - 1 - x] == b[b_hi - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            if not odd and -d <= delta - k <= d and x + forward[offset + delta - k] >= n:
+                return a_hi - x, b_hi - y, a_hi - x0, b_hi - y0
+    raise AssertionError("No middle snake")
+
+def matching_blocks(a, b):
+    # (i, j, length) of the runs a[i:i + length] == b[j:j + length] of a shortest edit script, in order
+    blocks = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        a_lo, a_hi, b_lo, b_hi = stack.pop()
+        start = a_lo
+        while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+            a_lo += 1
+            b_lo += 1
+        if a_lo > start:
+            blocks.append((start, b_lo - (a_lo - start), a_lo - start))
+        end = a_hi
+        while a_hi > a_lo and b_hi > b_lo and a[a_hi - 1] == b[b_hi - 1]:
+            a_hi -= 1
+            b_hi -= 1
+        if end > a_hi:
+            blocks.append((a_hi, b_hi, end - a_hi))
+        if a_lo == a_hi or b_lo == b_hi:
+            continue
+        x, y, u, v = middle_snake(a, a_lo, a_hi, b, b_lo, b_hi)
+        if u > x:
+            blocks.append((x, y, u - x))
+        stack.append((u, a_hi, v, b_hi))
+        stack.append((a_lo, x, b_lo, y))
+    blocks.sort()
+    return blocks
+
+def hunks(a, b):
+    # (a_start, a_end, b_start, b_end) of every changed range
+    i = j = 0
+    for x, y, length in matching_blocks(a, b) + [(len(a), len(b), 0)]:
+        if x > i or y > j:
+            yield i, x, j, y
+        i, j = x + length, y + length
+
+@dataclass
+class OpcodeDiff:
+    only_a: int = 0
+    only_b: int = 0
+    first_a: int = None
+    first_b: int = None
+
+def compare(units_a, units_b):
+    # Returns (hunks, {opcode: OpcodeDiff})
+    changes = list(hunks(fingerprints(units_a), fingerprints(units_b)))
+    by_opcode = defaultdict(OpcodeDiff)
+    for a_start, a_end, b_start, b_end in changes:
+        for unit in units_a[a_start:a_end]:
+            for opcode in unit.opcodes:
+                stats = by_opcode[opcode]
+                stats.only_a += 1
+                if stats.first_a is None:
+                    stats.first_a = unit.start
+        for unit in units_b[b_start:b_end]:
+            for opcode in unit.opcodes:
+                stats = by_opcode[opcode]
+                stats.only_b += 1
+                if stats.first_b is None:
+                    stats.first_b = unit.start
+    return changes, dict(by_opcode)
+
+def position(units, i):
+    # Sample position of unit i, or of the end of the stream
+    if i < len(units):
+        return units[i].start
+    return units[-1].end if units else 0
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare the command streams of two raw captures")
+    parser.add_argument("a", help="First capture")
+    parser.add_argument("b", help="Second capture")
+    parser.add_argument("--packets", action="store_true", help="Compare whole packets instead of single commands")
+    parser.add_argument("--ignore", type=lambda x: int(x, 0), action="append", default=[], help="Leave out this opcode (e.g. 0x02 for the heartbeats) - can be repeated")
+    parser.add_argument("--collapse-repeats", action="store_true", help="Leave out data packets identical to the previous one")
+    parser.add_argument("--hunks", type=int, default=10, help="Print this many changed ranges")
+    args = parser.parse_args()
+
+    ignore = set(args.ignore)
+    units_a = decode_units(args.a, args.packets, ignore, args.collapse_repeats)
+    units_b = decode_units(args.b, args.packets, ignore, args.collapse_repeats)
+    kind = "packets" if args.packets else "commands"
+    print(f"A: {len(units_a)} {kind}, B: {len(units_b)} {kind}")
+    changes, by_opcode = compare(units_a, units_b)
+    if not changes:
+        print("No differences")
+        return
+
+    a_start, _, b_start, _ = changes[0]
+    print(f"First divergence: A #{a_start} at sample {position(units_a, a_start)}, B #{b_start} at sample {position(units_b, b_start)}")
+    only_a = sum(a_end - a_start for a_start, a_end, _, _ in changes)
+    only_b = sum(b_end - b_start for _, _, b_start, b_end in changes)
+    print(f"{len(changes)} changed ranges - {only_a} {kind} only in A, {only_b} only in B")
+
+    print("Per opcode:")
+    for opcode, stats in sorted(by_opcode.items()):
+        firsts = ', '.join(f"{name} {sample}" for name, sample in (("A", stats.first_a), ("B", stats.first_b)) if sample is not None)
+        print(f"  {hex(opcode)}: -{stats.only_a} +{stats.only_b} (first at {firsts})")
+
+    for a_start, a_end, b_start, b_end in changes[:args.hunks]:
+        print(f"@@ A #{a_start}-{a_end} (sample {position(units_a, a_start)}), B #{b_start}-{b_end} (sample {position(units_b, b_start)})")
+        for unit in units_a[a_start:a_end]:
+            print(f"- {unit.start}-{unit.end}: {unit.describe()}")
+        for unit in units_b[b_start:b_end]:
+            print(f"+ {unit.start}-{unit.end}: {unit.describe()}")
+    if len(changes) > args.hunks:
+        print(f"... {len(changes) - args.hunks} more")
+
+if __name__ == "__main__":
+    main()
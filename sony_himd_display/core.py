@@ -0,0 +1,942 @@
+from enum import Enum
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+from collections import OrderedDict
+from functools import reduce, partial
+import operator
+import math
+import sys
+
+from .state import State, apply_event, row_text
+
+@dataclass(frozen = True)
+class Command:
+    opcode: int
+    length: int
+    handler: Callable[[any, bytes], None]
+    # For the text commands - the index of the header byte which holds the text length
+    length_index: Optional[int] = None
+
+def display_command_constlen(*, opcode = None, opcodes = None, length, length_index = None):
+    class class_level_decorator:
+        def __init__(self, fn):
+            self.fn = fn
+        def __set_name__(self, owner, name):
+            all_opcodes = list(opcodes or [])
+            if opcode:
+                all_opcodes.append(opcode)
+            for op in all_opcodes:
+                owner.constant_length_commands[op] = Command(
+                    op,
+                    length,
+                    self.fn,
+                    length_index
+                )
+                print(f"[Command Definition]: Added handler for command {hex(op)} - {name}", file=sys.stderr)
+    return class_level_decorator
+
+class DecodingState(Enum):
+    IDLE, PROLOGUE, DATA = range(3)
+
+class AnnotationType():
+    STATE, DEBUG, ASCII, COMMAND, ERROR, DEBUG2, EMU, STATS, SCREEN = range(9)
+
+ALL_ANNOTATION_TYPES = tuple(range(9))
+
+@dataclass
+class CommandRecord:
+    opcode: int
+    start: int
+    end: int
+    data: bytes
+    description: Optional[str] = None
+    events: List[dict] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    checksum_ok: bool = True
+    # The parsed arguments of the command - rows (the raw bitfield), text, from/to (bar positions)...
+    fields: dict = field(default_factory=dict)
+
+    def to_dict(self):
+        return {
+            "opcode": self.opcode,
+            "start": self.start,
+            "end": self.end,
+            "data": self.data,
+            "checksum_ok": self.checksum_ok,
+            "description": self.description,
+            "errors": self.errors,
+            "events": self.events,
+            **self.fields,
+        }
+
+PROLOGUE_OPCODES = ( 0x3D, 0x3F, 0xFF, 0x37, 0x1F, 0x2f, 0x3B )
+PROLOGUE_LENGTH = 3
+PACKET_LENGTH = 40
+
+ENCODING_MAP = {
+    0x05: 'latin1',
+    0x84: 'utf-16-be',
+    0x90: 'sjis',
+}
+SPECIAL_SJIS_SEQUENCES = {
+    0xFD: {
+        **dict((0x65 + x, f"big {x}") for x in range(10)),
+        0x70: 'volume icon',
+        0x86: "music note",
+        0x93: "folder",
+        0x6f: "minidisc",
+    },
+    0xFA: {
+        0x55: 'big :'
+    },
+}
+
+def decode_text_or_error(byte_text, encoding, errors):
+    # `byte_text` is any buffer - str() decodes memoryviews without copying them to bytes first
+    try:
+        return str(byte_text, encoding)
+    except UnicodeDecodeError:
+        errors.append("Text decoding error")
+        return str(byte_text, encoding, 'ignore')
+
+def decode_text(text_bytes, encoding):
+    # Returns the text for the annotations, the characters for the emulator, and the decoding errors.
+    errors = []
+    if encoding not in ENCODING_MAP:
+        errors.append(f"Unknown encoding: {hex(encoding)}")
+        encoding = 0x90
+    codec = ENCODING_MAP[encoding]
+    view = memoryview(text_bytes)
+    output_text = []
+    emu_data = []
+    run_start = 0
+    i = 0
+    while i < len(text_bytes):
+        first_seq_byte = text_bytes[i]
+        if first_seq_byte not in SPECIAL_SJIS_SEQUENCES:
+            i += 1
+            continue
+        temp_text = decode_text_or_error(view[run_start:i], codec, errors)
+        output_text.append(temp_text)
+        emu_data += temp_text
+        if i + 1 < len(text_bytes):
+            byte = text_bytes[i + 1]
+            namespace = SPECIAL_SJIS_SEQUENCES[first_seq_byte]
+            if byte not in namespace:
+                sequence_name = f"{hex(first_seq_byte)[2:]}{hex(byte)[2:]}"
+                errors.append(f"unknown char in {hex(first_seq_byte)} namespace - {hex(byte)}")
+            else:
+                sequence_name = namespace[byte]
+            output_text.append(f"<{sequence_name}>")
+            emu_data.append(sequence_name)
+        i += 2
+        run_start = i
+    temp_text = decode_text_or_error(view[run_start:], codec, errors)
+    output_text.append(temp_text)
+    emu_data += temp_text
+    return ''.join(output_text), tuple(emu_data), tuple(errors)
+
+class TextCache:
+    # The player keeps rewriting the same texts - bounded LRU cache in front of decode_text()
+    def __init__(self, size = 4096):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def decode(self, text_bytes, encoding):
+        key = (text_bytes, encoding)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+        self.misses += 1
+        entry = self.entries[key] = decode_text(text_bytes, encoding)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return entry
+
+def cache_statistics(hits, misses):
+    ratio = hits / (hits + misses) if hits + misses else 0
+    return (f"Text cache: {hits} hits, {misses} misses ({ratio:.1%} hit rate)", f"Text cache: {ratio:.0%}")
+
+class DecoderCore:
+    # Everything that understands the display protocol, without any dependency on libsigrokdecode.
+    # `annotate(start, end, annotation_type, texts)` receives the annotations, `transmit(event)`
+    # receives the emulator events. Both are optional.
+    # With `packet_mode`, whole packets are buffered and parsed at once instead of byte by byte.
+    # `collapse_repeats` (packet mode only) skips data packets identical to the previous one - they are
+    # neither annotated nor sent to the emulator, a run of them gets a single annotation instead.
+    # Only the annotation types in `annotation_types` are produced - the text for the others isn't
+    # even formatted. Command descriptions are still built for the descriptor file if there's one,
+    # or for the records if `describe` is set.
+    # `profiler` (a profiling.Profiler) gets per-opcode timings of the command handlers.
+    # The SCREEN annotations come from a screen model of its own, which the emulator events of every
+    # packet are applied to - the text on the whole screen, once per data packet.
+    constant_length_commands = {}
+    # Filled from constant_length_commands once the class is defined - opcode => Command or None
+    command_table = []
+
+    def __init__(self, annotate = None, transmit = None, packet_mode = False, descriptor_file = None, annotation_types = ALL_ANNOTATION_TYPES, collapse_repeats = False, describe = False, profiler = None):
+        self.annotate = annotate
+        self.transmit = transmit
+        self.profiler = profiler
+        if profiler:
+            self.transmit_to_emulator = partial(profiler.transmit, self.transmit_to_emulator)
+        self.descriptor_file = descriptor_file
+        self.collapse_repeats = collapse_repeats
+        if packet_mode:
+            self.feed = self.feed_packet
+
+        annotation_types = set(annotation_types) if annotate else set()
+        self.states_enabled = AnnotationType.STATE in annotation_types
+        self.ascii_enabled = AnnotationType.ASCII in annotation_types
+        self.debug_enabled = AnnotationType.DEBUG in annotation_types
+        self.debug2_enabled = AnnotationType.DEBUG2 in annotation_types
+        self.errors_enabled = AnnotationType.ERROR in annotation_types
+        self.emulator_marks_enabled = AnnotationType.EMU in annotation_types
+        self.stats_enabled = AnnotationType.STATS in annotation_types
+        self.screen_enabled = AnnotationType.SCREEN in annotation_types
+        self.commands_enabled = AnnotationType.COMMAND in annotation_types
+        self.describe = self.commands_enabled or bool(descriptor_file) or describe
+        self.reset()
+
+    def reset(self):
+        # Overall state
+        self.emulator_index = 0
+        self.state = DecodingState.IDLE
+        self.start_of_current_state = None
+        self.first_sample = None
+        self.text_cache = TextCache()
+
+        # Prologue handler state
+        self.prologue_bytes_remaining = 0
+
+        # Data handler state
+        self.data_bytes_remaining = 0
+        self.data_bytes_count = 0
+        self.data_xor = 0
+        # The bytes of the current data packet - the handlers get memoryview slices of it, which are
+        # only valid until they return
+        self.data_packet = bytearray(PACKET_LENGTH)
+        self.data_view = memoryview(self.data_packet)
+        self.data_current_command_offset = 0
+        self.data_current_command_start = 0
+        self.data_current_command_end = 0
+        self.data_current_command_bytes_remaining = 0
+        self.data_current_command_info = None
+
+        # Packet parser state - the packet is buffered in place, the same way
+        self.packet = bytearray(PACKET_LENGTH)
+        self.packet_view = memoryview(self.packet)
+        self.packet_fill = 0
+        self.packet_starts = [0] * PACKET_LENGTH
+        self.packet_ends = [0] * PACKET_LENGTH
+        self.packet_length = 0
+        self.last_packet = None
+        self.last_packet_hash = None
+        self.repeat_count = 0
+        self.repeat_start = self.repeat_end = 0
+
+        self.screen = State()
+
+        # Records of the packet being decoded, handed out once its checksum is known
+        self.current_record = None
+        self.records = []
+
+    def put(self, start, end, annotation_type, texts):
+        if self.annotate:
+            self.annotate(start, end, annotation_type, texts)
+
+    def statistics(self):
+        stats = [cache_statistics(self.text_cache.hits, self.text_cache.misses)]
+        if self.profiler:
+            stats.append(self.profiler.summary())
+        return stats
+
+    def finish(self):
+        # End of the stream - puts the statistics over the whole capture
+        self.put_repeats()
+        if self.stats_enabled and self.first_sample is not None:
+            for texts in self.statistics():
+                self.put(self.first_sample, self.start_of_current_state, AnnotationType.STATS, [*texts])
+
+    def switch_state(self, newState, first_of_new):
+        if self.states_enabled:
+            self.put(self.start_of_current_state, first_of_new,
+                     AnnotationType.STATE, [f"State: {self.state.name}"])
+        self.start_of_current_state = first_of_new
+        self.state = newState
+
+    def handle_starting_byte(self, b, s, e):
+        if b in PROLOGUE_OPCODES:
+            self.switch_state(DecodingState.PROLOGUE, s)
+            self.prologue_bytes_remaining = PROLOGUE_LENGTH
+        else:
+            self.switch_state(DecodingState.DATA, s)
+            self.data_bytes_count = 0
+            self.data_bytes_remaining = PACKET_LENGTH
+            self.data_xor = 0
+            self.data_current_command_offset = 0
+            self.data_current_command_start = 0
+            self.data_current_command_end = 0
+            self.data_current_command_bytes_remaining = 0
+            self.data_current_command_info = None
+
+    def handle_prologue_message(self, b, s, e):
+        self.prologue_bytes_remaining -= 1
+        if self.prologue_bytes_remaining == 0:
+            self.switch_state(DecodingState.IDLE, e)
+
+    def run_command(self, handler, data):
+        self.current_record = CommandRecord(data[0], self.data_current_command_start,
+                                            self.data_current_command_end, bytes(data))
+        self.records.append(self.current_record)
+        if self.descriptor_file:
+            self.descriptor_file.log_command(data, self.data_current_command_start, self.data_current_command_end)
+        if self.profiler:
+            self.profiler.run_command(handler, self, data)
+        else:
+            handler(self, data)
+        self.current_record = None
+
+    def put_screen(self, start, end):
+        screen = self.screen
+        for record in self.records:
+            for event in record.events:
+                screen = apply_event(screen, event)
+        self.screen = screen
+        rows = [row_text(row) for row in screen.screen_matrix]
+        full = ' | '.join(
+            f"{i}{'*' if row.inverted else ''}: '{text}'" for i, (row, text) in enumerate(zip(screen.screen_matrix, rows))
+        )
+        if screen.scroll_bar_state.enabled:
+            full += f" | scroll {screen.scroll_bar_state.from_px}-{screen.scroll_bar_state.to_px}"
+        if screen.track_bar_state.enabled:
+            full += f" | track {screen.track_bar_state.from_px}-{screen.track_bar_state.to_px} in {screen.track_bar_state.row}"
+        self.put(start, end, AnnotationType.SCREEN, [full, ' | '.join(x for x in rows if x) or "(blank)"])
+
+    def finish_packet(self, checksum_ok, start, end):
+        if self.profiler:
+            self.profiler.packet(checksum_ok)
+        if self.screen_enabled:
+            self.put_screen(start, end)
+        for record in self.records:
+            record.checksum_ok = checksum_ok
+        records, self.records = self.records, []
+        self.current_record = None
+        return records
+
+    def handle_data_message(self, b, s, e):
+        self.data_xor ^= b
+
+        self.data_bytes_remaining -= 1
+        index = PACKET_LENGTH - 1 - self.data_bytes_remaining
+        self.data_packet[index] = b
+        if self.data_bytes_remaining == 0:
+            if self.data_xor != 0xFF:
+                self.put(self.start_of_current_state, e, AnnotationType.ERROR, [f"Checksum mismatch! ({hex(self.data_xor)} != 0xFF)"])
+            #if self.data_bytes_count > 10:
+            #    self.put(s, e, AnnotationType.DEBUG, [f"Debug: Dense packet"])
+            if self.data_current_command_bytes_remaining != 0:
+                self.put(self.start_of_current_state, e, AnnotationType.ERROR, [f"Packet ended, but current command still has {self.data_current_command_bytes_remaining} bytes remaining!", f"-{self.data_current_command_bytes_remaining}"])
+            start = self.start_of_current_state
+            self.switch_state(DecodingState.IDLE, e)
+            return self.finish_packet(self.data_xor == 0xFF, start, e)
+        if b:
+            self.data_bytes_count += 1
+
+        if not self.data_current_command_bytes_remaining:
+            # No command being processed right now
+            info = self.command_table[b]
+            if info:
+                # This is our command now
+                self.data_current_command_bytes_remaining = info.length
+                self.data_current_command_start = s
+                self.data_current_command_offset = index
+                self.data_current_command_info = info
+            elif b != 0:
+                self.data_current_command_start, self.data_current_command_end = s, e
+                self.put_invalid_byte(b)
+
+        # Command in progress...
+        if self.data_current_command_bytes_remaining:
+            self.data_current_command_bytes_remaining -= 1
+            self.data_current_command_end = e
+            if not self.data_current_command_bytes_remaining:
+                info = self.data_current_command_info
+                offset = self.data_current_command_offset
+                if info.length_index is not None and index + 1 - offset == info.length:
+                    # Only the header of a text command so far - now we know how long the text is.
+                    self.data_current_command_bytes_remaining = self.data_packet[offset + info.length_index] & 0b01111111
+                if not self.data_current_command_bytes_remaining:
+                    # We've read all the bytes of the current command
+                    self.run_command(info.handler, self.data_view[offset:index + 1])
+        return ()
+
+    def put_invalid_byte(self, b):
+        self.current_record = CommandRecord(b, self.data_current_command_start, self.data_current_command_end, bytes([b]))
+        self.records.append(self.current_record)
+        if self.describe:
+            self.put_command(f"Byte {hex(b)} - not a valid command", "?")
+        self.put_error(f"Byte {hex(b)} - not a valid command")
+        self.current_record = None
+
+    def parse_packet(self):
+        length = self.packet_fill
+        self.packet_fill = 0
+        packet = self.packet_view[:length]
+        starts, ends = self.packet_starts, self.packet_ends
+        first, last = starts[0], ends[length - 1]
+        if self.state == DecodingState.PROLOGUE:
+            self.switch_state(DecodingState.IDLE, last)
+            return ()
+
+        if self.collapse_repeats:
+            packet_bytes = bytes(packet)
+            packet_hash = hash(packet_bytes)
+            if packet_hash == self.last_packet_hash and packet_bytes == self.last_packet:
+                # Same as the previous data packet - it can't change anything, only extend the run.
+                if not self.repeat_count:
+                    self.repeat_start = first
+                self.repeat_count += 1
+                self.repeat_end = last
+                self.switch_state(DecodingState.IDLE, last)
+                return ()
+            self.put_repeats()
+            self.last_packet_hash, self.last_packet = packet_hash, packet_bytes
+
+        if self.ascii_enabled:
+            # The first byte of a packet is still seen in the IDLE state
+            for i in range(1, PACKET_LENGTH):
+                value = packet[i]
+                if ord(' ') <= value < ord('z'):
+                    self.put(starts[i], ends[i], AnnotationType.ASCII, [f"'{chr(value)}'"])
+
+        xor = reduce(operator.xor, packet)
+        table = self.command_table
+        # The last byte is the checksum
+        payload_end = PACKET_LENGTH - 1
+        i = 0
+        while i < payload_end:
+            b = packet[i]
+            if not b:
+                i += 1
+                continue
+            info = table[b]
+            if not info:
+                self.data_current_command_start, self.data_current_command_end = starts[i], ends[i]
+                self.put_invalid_byte(b)
+                i += 1
+                continue
+            length = info.length
+            if info.length_index is not None and i + info.length_index < payload_end:
+                length += packet[i + info.length_index] & 0b01111111
+            command_end = i + length
+            if command_end > payload_end:
+                missing = command_end - payload_end
+                self.put(first, last, AnnotationType.ERROR, [f"Packet ended, but current command still has {missing} bytes remaining!", f"-{missing}"])
+                break
+            self.data_current_command_start, self.data_current_command_end = starts[i], ends[command_end - 1]
+            self.run_command(info.handler, packet[i:command_end])
+            i = command_end
+
+        if xor != 0xFF:
+            self.put(first, last, AnnotationType.ERROR, [f"Checksum mismatch! ({hex(xor)} != 0xFF)"])
+        self.switch_state(DecodingState.IDLE, last)
+        return self.finish_packet(xor == 0xFF, first, last)
+
+    def put_repeats(self):
+        if self.repeat_count:
+            if self.commands_enabled:
+                self.put(self.repeat_start, self.repeat_end, AnnotationType.COMMAND, [
+                    f"Previous packet repeated {self.repeat_count} times", f"Repeated x{self.repeat_count}", f"x{self.repeat_count}"
+                ])
+            self.repeat_count = 0
+
+    def feed_packet(self, start, end, value):
+        # Same as feed(), but only buffers the bytes until the whole prologue / packet is in.
+        if self.start_of_current_state is None:
+            self.start_of_current_state = self.first_sample = start
+
+        if self.state == DecodingState.IDLE:
+            self.handle_starting_byte(value, start, end)
+            self.packet_length = PROLOGUE_LENGTH if self.state == DecodingState.PROLOGUE else PACKET_LENGTH
+
+        fill = self.packet_fill
+        self.packet[fill] = value
+        self.packet_starts[fill] = start
+        self.packet_ends[fill] = end
+        self.packet_fill = fill + 1
+        if self.packet_fill == self.packet_length:
+            return self.parse_packet()
+        return ()
+
+    def feed(self, start, end, value):
+        # Returns the records of a data packet once its last byte has been fed.
+        if self.ascii_enabled and value in range(ord(' '), ord('z')) and self.state == DecodingState.DATA:
+            self.put(start, end, AnnotationType.ASCII, [f"'{chr(value)}'"])
+
+        # Make sure the first sample of the current state is set correctly.
+        if self.start_of_current_state is None:
+            self.start_of_current_state = self.first_sample = start
+
+        # If idling, send the byte to the idle state handler, then check the state again
+        # the idle state handler itself shouldn't alter the state of any of the two
+        # other modes of operation.
+        if self.state == DecodingState.IDLE:
+            self.handle_starting_byte(value, start, end)
+
+        if self.state == DecodingState.PROLOGUE:
+            self.handle_prologue_message(value, start, end)
+        elif self.state == DecodingState.DATA:
+            return self.handle_data_message(value, start, end)
+        return ()
+
+    def create_rows_string(self, rows, inverted = False):
+        rows_list = [x for x in range(6) if (((1 << x) & rows) != 0) ^ inverted]
+        rowsstr = ', '.join(str(x) for x in rows_list)
+        return (rowsstr, rows_list)
+
+    def single_row(self, rows):
+        # The row of a text command's bitfield, or None if it has none of the display's rows - a bit
+        # error, the checksum is only checked once the packet is over
+        if not rows or rows >> 6:
+            self.put_error(f"Invalid row bitfield {hex(rows)}", "Bad rows")
+            return None
+        return int(math.log(rows, 2))
+
+    def set_fields(self, **fields):
+        if self.current_record:
+            self.current_record.fields.update(fields)
+
+    def put_command(self, *desc):
+        if self.commands_enabled:
+            self.put(self.data_current_command_start, self.data_current_command_end,
+                     AnnotationType.COMMAND, [*desc])
+        if self.current_record:
+            self.current_record.description = desc[0]
+        if self.descriptor_file:
+            self.descriptor_file.log_described(desc[0])
+    def put_error(self, *desc):
+        if self.errors_enabled:
+            self.put(self.data_current_command_start, self.data_current_command_end,
+                     AnnotationType.ERROR, [*desc])
+        if self.current_record:
+            self.current_record.errors.append(desc[0])
+    def put_debug(self, *desc):
+        self.put(self.data_current_command_start, self.data_current_command_end,
+                 AnnotationType.DEBUG, [*desc])
+    def put_debug2(self, *desc):
+        self.put(self.data_current_command_start, self.data_current_command_end,
+                 AnnotationType.DEBUG2, [*desc])
+
+    def handle_unknown_command(self, data):
+        if not self.describe:
+            return
+        bindump = ' '.join(('0' if x < 0x10 else '') + hex(x)[2:] for x in data)
+        self.put_command(f"Command: '{bindump}'", bindump)
+
+    def transmit_to_emulator(self, data):
+        if self.current_record:
+            self.current_record.events.append(data)
+        if self.transmit:
+            if self.emulator_marks_enabled:
+                self.put(self.data_current_command_start, self.data_current_command_end,
+                         AnnotationType.EMU, [f"Emulator command #{self.emulator_index} ({data['type']})", f"#{self.emulator_index} ({data['type']})", f"#{self.emulator_index}"])
+            if self.descriptor_file:
+                self.descriptor_file.log_emulator_marker(self.emulator_index)
+            self.emulator_index += 1
+            self.transmit(data)
+
+    @display_command_constlen(opcode = 0x02, length = 0x02)
+    def handle_command_02_hb1(self, data):
+        additional = data[1]
+        if additional != 0x81 and self.debug_enabled:
+            self.put_debug(f"Heartbeat 0x02 {additional=}")
+        if self.describe:
+            self.put_command("Heartbeat 0x02", "HB2")
+
+    @display_command_constlen(opcode = 0x03, length = 0x02)
+    def handle_command_03_clearrows(self, data):
+        rows = []
+        for i in range(6):
+            if (data[1] & (1 << i)) != 0:
+                rows.append(i)
+        rows_str = ', '.join(str(x) for x in rows)
+        self.set_fields(rows = data[1])
+        if self.describe:
+            self.put_command(f"Clear rows {rows_str}", f"Clear {rows_str}", "CLR")
+        self.transmit_to_emulator({
+            "type": "clear",
+            "rows": rows,
+        })
+
+    @display_command_constlen(opcode = 0x04, length = 0x02)
+    def handle_command_04(self, data):
+        # Probably "Redraw selected rows"
+        if self.describe:
+            self.put_command(f"Inverse of the previous 0x05 command", "INV04", "04")
+
+    @display_command_constlen(opcode = 0x05, length = 0x02)
+    def handle_command_05_inv(self, data):
+        rows = data[1]
+        rowsstr, rows_list = self.create_rows_string(rows, True)
+        self.set_fields(rows = rows)
+        self.transmit_to_emulator({
+            "type": "invert",
+            "rows": rows_list,
+        })
+        if self.describe:
+            self.put_command(f"Invert rows {rowsstr}", f"Invert {rowsstr}", "Invert", "INV")
+
+    @display_command_constlen(opcode = 0x11, length = 0x02)
+    def handle_command_11_format(self, data):
+        format_info = data[1]
+        is_hi = format_info & 2
+        is_md = format_info & 1
+        self.set_fields(hi = bool(is_hi), md = bool(is_md))
+        self.transmit_to_emulator({
+            "type": "format",
+            "hi": is_hi,
+            "md": is_md
+        })
+        if self.describe:
+            self.put_command(f"Format icons: {is_hi=} {is_md}", f"{is_hi=} {is_md}", "Format", "FMT")
+
+    @display_command_constlen(opcode = 0x13, length = 0x02)
+    def handle_command_13_battery(self, data):
+        bitfield = data[1]
+        is_charging = bitfield & (1 << 7)
+        tiles = (bitfield & 0b11110) >> 1
+        tiles_str = ', '.join(str(x) for x in range(4) if tiles & (1 << x))
+        outline = bitfield & 1
+        self.set_fields(charging = bool(is_charging), outline = bool(outline), tiles = tiles)
+        self.transmit_to_emulator({
+            "type": "battery",
+            "isCharging": is_charging,
+            "outlineEnabled": outline,
+            "tiles": tiles
+        })
+        if self.describe:
+            self.put_command(f"Battery: {outline=} tiles={tiles_str}, {is_charging=}", "Battery")
+
+    @display_command_constlen(opcode = 0x17, length = 0x02)
+    def handle_command_17_groups(self, data):
+        enabled = data[1]
+        self.set_fields(enabled = bool(enabled))
+        self.transmit_to_emulator({
+            "type": "groups",
+            "enabled": enabled,
+        })
+        if self.describe:
+            self.put_command(f"Groups: {'On' if enabled else 'Off'}", "Groups", "GRP")
+
+    @display_command_constlen(opcode = 0x18, length = 0x02)
+    def handle_command_18_playmode(self, data):
+        bitfield = ["REP", "1", "SHUF", "A->"]
+        enabled_bitfield = data[1]
+        entries = ', '.join(x for i, x in enumerate(bitfield) if enabled_bitfield & (1 << i))
+        self.set_fields(modes = enabled_bitfield)
+        self.transmit_to_emulator({
+            "type": "playmode",
+            "entries": entries
+        })
+        if self.describe:
+            self.put_command(f"Play mode: {entries}", "Play mode", "PM")
+
+    @display_command_constlen(opcode = 0x1B, length = 0x02)
+    def handle_command_1b_playglyph(self, data):
+        glyph = data[1]
+        glyphs = ["none", "stop", "play", "pause", "ff", "rev", "ffn", "revp"]
+        if glyph >= len(glyphs):
+            self.put_error(f"Unknown glyph {glyph}", "Bad glyph")
+            return
+        self.set_fields(glyph = glyphs[glyph])
+        self.transmit_to_emulator({
+            "type": "glyph",
+            "glyph": glyphs[glyph]
+        })
+        if self.describe:
+            self.put_command(f"Display glyph: {glyphs[glyph]}", f"Glyph: {glyphs[glyph]}", glyphs[glyph])
+
+    @display_command_constlen(opcode = 0x20, length = 0x02)
+    def handle_command_20(self, data):
+        # RH910 only
+        # Contrast maybe? The RH910 is an LCD device - OLEDs don't have contrast config.
+        self.handle_unknown_command(data)
+
+    @display_command_constlen(opcode = 0x23, length = 0x02)
+    def handle_command_23_topbar(self, data):
+        action = "Enable" if data[1] else "Disable"
+        self.set_fields(enabled = bool(data[1]))
+        self.transmit_to_emulator({
+            "type": "bar",
+            "enabled": not not data[1]
+        })
+        if self.describe:
+            self.put_command(f"{action} bar at the top", f"{action[:2].upper()} bar")
+
+    @display_command_constlen(opcode = 0x24, length = 0x02)
+    def handle_command_24(self, data):
+        self.handle_unknown_command(data)
+
+    @display_command_constlen(opcode = 0x30, length = 0x02)
+    def handle_command_30_set_contrast(self, data):
+        contrast = data[1]
+        self.set_fields(contrast = contrast)
+        if self.describe:
+            self.put_command(f"Set contrast to {contrast}", "Contrast")
+
+    @display_command_constlen(opcode = 0x50, length = 0x05)
+    def handle_command_50(self, data):
+        self.handle_unknown_command(data)
+
+    @display_command_constlen(opcode = 0x53, length = 0x05)
+    def handle_command_53_limit(self, data):
+        rows = data[1]
+        rowsstr, rowslist = self.create_rows_string(rows)
+        start = data[2]
+        end = data[3]
+        self.set_fields(rows = rows, limit_start = start, limit_end = end)
+        self.transmit_to_emulator({
+            "type": "limit",
+            "start": start,
+            "end": end,
+            "rows": rowslist
+        })
+        if self.describe:
+            self.put_command(f"Limit text commands for {rowsstr} - start at {start}, end at {end}" f"Limit {rowsstr} - {start}:{end}", "Limit")
+
+    @display_command_constlen(opcode = 0x54, length = 0x05)
+    def handle_command_54_scroll(self, data):
+        # Invert rows
+        rows = data[1]
+        rowsstr, _ = self.create_rows_string(rows)
+        self.set_fields(rows = rows)
+        if self.describe:
+            self.put_command(f"Enable scrolling for {rowsstr}?", f"Scroll {rowsstr}", "Scroll", "SCRL")
+
+
+    @display_command_constlen(opcode = 0x56, length = 0x05)
+    def handle_command_56(self, data):
+        rows = data[1]
+        # Unknown
+        key = data[2]
+        value = data[3]
+        # /Unknown
+        rowsstr, _ = self.create_rows_string(rows)
+        self.set_fields(rows = rows, key = key, value = value)
+        if self.describe:
+            self.put_command(f"For rows {rowsstr}, set {key}={value}", f"{rowsstr}, {key}={value}", f"AFF{rowsstr}", "AFF")
+
+    @display_command_constlen(opcode = 0x68, length = 0x05)
+    def handle_command_68(self, data):
+        # Scrollbar command
+        px_start = data[1]
+        px_end = data[2]
+        unk_use_smaller_list = data[3]
+        enable = data[4]
+        self.set_fields(**{"from": px_start, "to": px_end, "enabled": enable == 1})
+        self.transmit_to_emulator({
+            "type": "scrollbar",
+            "from": px_start,
+            "to": px_end,
+            "enabled": enable == 1
+        })
+
+        if self.describe:
+            self.put_command(
+                f"Scrollbar - set bar from px {px_start} to {px_end} ({unk_use_smaller_list})" if enable else 'Disable scrollbar',
+                f"Scroll {px_start} => {px_end}" if enable else 'Scroll disable',
+                f"Scroll {'EN' if enable else 'DIS'}"
+            )
+
+    @display_command_constlen(opcode = 0x69, length = 0x05)
+    def handle_command_69(self, data):
+        # Track progress bar mid-playback command
+        rows = data[1]
+        unk_px_start = data[2]
+        unk_px_end = data[3]
+        unk_enabled = data[4]
+
+        rowsstr, rows_list = self.create_rows_string(rows)
+        if not rows_list:
+            self.put_error(f"No row in the bitfield {hex(rows)}", "Bad rows")
+            return
+        self.set_fields(**{"rows": rows, "from": unk_px_start, "to": unk_px_end, "enabled": bool(unk_enabled)})
+
+        self.transmit_to_emulator({
+            "type": "trackbar",
+            "from": unk_px_start,
+            "to": unk_px_end,
+            "enabled": unk_enabled,
+            "rows": rows_list[0],
+        })
+
+        if self.describe:
+            self.put_command(
+                f"? In row {rowsstr} set track progress bar from {unk_px_start} to {unk_px_end}" if unk_enabled else f'? In row {rowsstr} disable track progress bar',
+                f"? Trackbar {unk_px_start} => {unk_px_end}" if unk_enabled else 'Disable trackbar',
+                'Trackbar on' if unk_enabled else 'Trackbar off',
+            )
+        if self.debug2_enabled:
+            self.put_debug2("trackbar")
+
+    @display_command_constlen(opcode = 0x6a, length = 0x05)
+    def handle_command_6a(self, data):
+        self.handle_unknown_command(data)
+
+    @display_command_constlen(opcode = 0x6b, length = 0x05)
+    def handle_command_6b(self, data):
+        self.handle_unknown_command(data)
+
+    @display_command_constlen(opcode = 0x75, length = 0x07)
+    def handle_command_75(self, data):
+        self.handle_unknown_command(data)
+
+    @display_command_constlen(opcode = 0x91, length = 0x0A)
+    def handle_command_91(self, data):
+        self.handle_unknown_command(data)
+
+    def process_text(self, text_bytes, encoding):
+        # The only copy of the text: the cache key has to outlive the packet buffer, and views of a
+        # bytearray can't be hashed for the lookup anyway
+        output_text, emu_data, errors = self.text_cache.decode(bytes(text_bytes), encoding)
+        for error in errors:
+            self.put_error(error)
+        return output_text, list(emu_data)
+
+
+
+    # The text commands' lengths cover the header - the text length is in the header's length_index byte.
+    @display_command_constlen(opcode = 0xE2, length = 0x05, length_index = 3)
+    def handle_e2_command(self, data):
+        flag_bit = (data[2] & (1 << 7)) != 0
+        encoding = data[4]
+        what = data[2]
+        row = self.single_row(data[1])
+        if row is None:
+            return
+        text_bytes = data[5:]
+        output_text, emu_data = self.process_text(text_bytes, encoding)
+        self.set_fields(rows = data[1], row = row, col = 0, encoding = encoding, text = output_text)
+        if self.describe:
+            self.put_command(
+                f"Write special '{output_text}' in {row=} {what=}",
+                f"Writesp '{output_text}' in {row=} {what=}",
+                f"S'{output_text}'"
+            )
+
+        self.transmit_to_emulator({
+            "type": "display",
+            "row": row,
+            "col": 0,
+            "data": emu_data,
+            "clearRemaining": False,
+        })
+
+    @display_command_constlen(opcodes = [0xE0, 0xE3], length = 0x04, length_index = 2)
+    def handle_text_command(self, data):
+        # What col and row are in reality is unknown
+        col = 4 if data[0] == 0xE3 else 0
+        row = self.single_row(data[1])
+        if row is None:
+            return
+        encoding = data[3]
+        text_bytes = data[4:]
+
+        output_text, emu_data = self.process_text(text_bytes, encoding)
+        self.set_fields(rows = data[1], row = row, col = col, encoding = encoding, text = output_text)
+
+        if self.describe:
+            self.put_command(
+                f"Write '{output_text}' in ?{row=}, ?{col=}",
+                f"Write '{output_text}' in ?{row=}, ?{col=}",
+                f"'{output_text}'"
+            )
+
+        self.transmit_to_emulator({
+            "type": "display",
+            "row": row,
+            "col": col,
+            "data": emu_data,
+            "clearRemaining": True,
+        })
+
+DecoderCore.command_table = [DecoderCore.constant_length_commands.get(x) for x in range(256)]
+
+def iter_spi_file(path, chunk_size = 1 << 16):
+    # A raw dump of the MOSI bytes - the byte offset doubles as the sample number.
+    offset = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            for i, b in enumerate(chunk, offset):
+                yield (i, i + 1, b)
+            offset += len(chunk)
+
+def decode_stream(spi, core = None, **kwargs):
+    # `spi` is any iterable of (start, end, byte) tuples.
+    core = core or DecoderCore(**kwargs)
+    feed = core.feed
+    for start, end, value in spi:
+        records = feed(start, end, value)
+        if records:
+            yield from records
+    core.finish()
+
+def decode_file(path, core = None, **kwargs):
+    yield from decode_stream(iter_spi_file(path), core, **kwargs)
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Decode a raw dump of the RH10/RH910 display SPI stream")
+    parser.add_argument("capture", help="File containing the raw MOSI bytes")
+    parser.add_argument("--parser", choices=("packet", "byte"), default="packet", help="Parse whole packets at once, or byte by byte")
+    parser.add_argument("--collapse-repeats", action="store_true", help="Skip data packets identical to the previous one")
+    parser.add_argument("--descriptor-log", default=None, help="Also write a binary descriptor log to this path")
+    parser.add_argument("--profile", default=None, help="Time the command handlers, and write the counters to this JSON file")
+    parser.add_argument("--text-index", default=None, help="Also index the texts written to the display in this file (see textindex)")
+    parser.add_argument("--jobs", type=int, default=None, help="Decode on this many processes, in chunks split at packet boundaries (0: one per CPU)")
+    parser.add_argument("--chunk", type=int, default=1 << 20, help="Bytes per chunk with --jobs")
+    args = parser.parse_args()
+    if args.jobs is not None and args.descriptor_log:
+        parser.error("--descriptor-log can't be used with --jobs")
+    profiler = None
+    if args.profile:
+        from .profiling import Profiler
+        profiler = Profiler()
+    descriptor_file = None
+    if args.descriptor_log:
+        from .desclog import DescriptionFile
+        descriptor_file = DescriptionFile(args.descriptor_log)
+    text_index = None
+    if args.text_index:
+        from .textindex import TextIndex
+        text_index = TextIndex(args.text_index)
+        text_index.clear()
+    if args.jobs is not None:
+        from .parallel import ParallelDecoder
+        core = ParallelDecoder(jobs = args.jobs, chunk_size = args.chunk, packet_mode = args.parser == "packet", collapse_repeats = args.collapse_repeats, describe = True, profiler = profiler)
+        records = core.decode_file(args.capture)
+    else:
+        core = DecoderCore(packet_mode = args.parser == "packet", descriptor_file = descriptor_file, collapse_repeats = args.collapse_repeats, describe = True, profiler = profiler)
+        records = decode_file(args.capture, core)
+    for record in records:
+        status = '' if record.checksum_ok else ' [checksum mismatch]'
+        errors = ''.join(f' !{x}' for x in record.errors)
+        print(f"{record.start}-{record.end} {hex(record.opcode)}: {record.description}{status}{errors}")
+        if text_index:
+            text_index.add_record(record)
+    for texts in core.statistics():
+        print(texts[0], file=sys.stderr)
+    if descriptor_file:
+        descriptor_file.close()
+    if text_index:
+        text_index.close()
+    if profiler:
+        profiler.dump(args.profile)
+
+if __name__ == "__main__":
+    main()
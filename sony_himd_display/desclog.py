@@ -0,0 +1,125 @@
+import struct
+import mmap
+import os
+
+# Binary command log. The log file is a sequence of records:
+#   kind (u8), payload length (u16), start sample (u64), end sample (u64), payload
+# Every COMMAND record is followed by the DESCRIPTION / EMU_MARKER records which belong to it.
+# The sidecar index (<log>.idx) holds a (start sample, file offset) pair for every COMMAND record,
+# in the order they were written - so it's sorted by sample, and can be binary searched in place.
+MAGIC = b'RH10DSC1'
+RECORD_HEADER = struct.Struct('<BHQQ')
+INDEX_ENTRY = struct.Struct('<QQ')
+EMU_MARKER = struct.Struct('<I')
+
+class RecordKind():
+    COMMAND, DESCRIPTION, EMU_MARKER = range(1, 4)
+
+def index_path(path):
+    return path + '.idx'
+
+class DescriptionFile:
+    def __init__(self, path, buffer_size = 1 << 20) -> None:
+        self.path = path
+        self.handle = open(path, 'wb', buffering=buffer_size)
+        self.index = open(index_path(path), 'wb', buffering=buffer_size)
+        self.handle.write(MAGIC)
+        self.offset = len(MAGIC)
+        self.start = self.end = 0
+    def write_record(self, kind, payload):
+        self.handle.write(RECORD_HEADER.pack(kind, len(payload), self.start, self.end))
+        self.handle.write(payload)
+        self.offset += RECORD_HEADER.size + len(payload)
+    def log_command(self, command: bytes, start: int, end: int) -> None:
+        self.start, self.end = start, end
+        self.index.write(INDEX_ENTRY.pack(start, self.offset))
+        self.write_record(RecordKind.COMMAND, bytes(command))
+    def log_described(self, text: str) -> None:
+        self.write_record(RecordKind.DESCRIPTION, text.encode('utf-8'))
+    def log_emulator_marker(self, marker_index: int) -> None:
+        self.write_record(RecordKind.EMU_MARKER, EMU_MARKER.pack(marker_index))
+    def close(self):
+        self.handle.close()
+        self.index.close()
+
+class DescriptionLog:
+    # Reads a log written by DescriptionFile, without loading it into memory.
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a descriptor log")
+        self.index = None
+        if os.path.getsize(index_path(path)):
+            with open(index_path(path), 'rb') as f:
+                self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        # Number of commands
+        return len(self.index) // INDEX_ENTRY.size if self.index else 0
+
+    def index_entry(self, i):
+        return INDEX_ENTRY.unpack_from(self.index, i * INDEX_ENTRY.size)
+
+    def find(self, sample):
+        # Offset of the last command which started at, or before `sample`
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            if self.index_entry(mid)[0] <= sample:
+                low = mid + 1
+            else:
+                high = mid
+        return self.index_entry(max(low - 1, 0))[1] if len(self) else len(self.data)
+
+    def records(self, offset = len(MAGIC)):
+        # Yields (kind, start, end, payload)
+        data = self.data
+        while offset < len(data):
+            kind, length, start, end = RECORD_HEADER.unpack_from(data, offset)
+            offset += RECORD_HEADER.size
+            yield kind, start, end, data[offset:offset + length]
+            offset += length
+
+    def commands(self, sample = None):
+        # Yields (start, end, command bytes, descriptions, emulator markers) from the command at `sample` on
+        offset = len(MAGIC) if sample is None else self.find(sample)
+        current = None
+        for kind, start, end, payload in self.records(offset):
+            if kind == RecordKind.COMMAND:
+                if current:
+                    yield current
+                current = (start, end, payload, [], [])
+            elif current and kind == RecordKind.DESCRIPTION:
+                current[3].append(payload.decode('utf-8'))
+            elif current and kind == RecordKind.EMU_MARKER:
+                current[4].append(EMU_MARKER.unpack(payload)[0])
+        if current:
+            yield current
+
+    def close(self):
+        self.data.close()
+        if self.index:
+            self.index.close()
+
+def main():
+    import argparse
+    import itertools
+    parser = argparse.ArgumentParser(description="Print the commands from a descriptor log")
+    parser.add_argument("log", help="Log written by the decoder")
+    parser.add_argument("--at", type=int, default=None, help="Start at the command at this sample")
+    parser.add_argument("--count", type=int, default=None, help="Number of commands to print")
+    args = parser.parse_args()
+    log = DescriptionLog(args.log)
+    for start, end, command, descriptions, markers in itertools.islice(log.commands(args.at), args.count):
+        print('-' * 80)
+        print(f"{start}-{end}: {command.hex(' ')}")
+        for i, text in enumerate(descriptions):
+            print(f'{i + 1}. {text}')
+        for marker in markers:
+            print(f'---EMU MARKER #{marker}---')
+    log.close()
+
+if __name__ == "__main__":
+    main()
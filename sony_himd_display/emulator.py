@@ -1,158 +1,124 @@
-from threading import Thread
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import Qt
-from dataclasses import dataclass, field
-from copy import deepcopy
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from typing import List, Union
+from collections import OrderedDict
+import threading
+import tempfile
 import json
+import time
+import sys
+import os
 
-DEFAULT_COLOR = (0, 101, 184)
-SCROLL_BAR_WIDTH = 6
-TOP_RESERVED_PX = 15
-TRACK_BAR_WIDTH = 65
-TRACK_BAR_HMARGIN = 5
-TRACK_BAR_STARTX = 60 #?
-
-class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(b'RH10 emulator running!')
-    def do_POST(self):
-        content_length = int(self.headers['Content-Length'])
-        body = b''
-        while len(body) < content_length:
-            body += self.rfile.read(content_length - len(body))
-        self.send_response(200)
-        self.end_headers()
-        string = body.decode("utf-8")
-        handle_event(json.loads(string))
-
-
-def server_main():
-    httpd = HTTPServer(('localhost', 36002), SimpleHTTPRequestHandler)
-    httpd.serve_forever()
-
-ht_thread = Thread(target=server_main)
-ht_thread.start()
-@dataclass
-class Row:
-    data: List[str] = field(default_factory=lambda: [''] * 20)
-    inverted: bool = False
-    start: int = 0x00
-    end: int = 0x19
-
-def create_screen_matrix():
-    a = []
-    for _ in range(6):
-        a.append(Row())
-    return a
-
-@dataclass
-class ScrollBar:
-    enabled: bool = False
-    from_px: int = 0
-    to_px: int = 0
-
-@dataclass
-class TrackBar:
-    enabled: bool = False
-    from_px: int = 0
-    to_px: int = 0
-    row: int = 0
-    
-@dataclass
-class Battery:
-    outline: bool
-    enabled: bool
-    charging: bool
-    segments: int
-
-@dataclass
-class State:
-    screen_matrix: List[Row] = field(default_factory=create_screen_matrix)
-    message: str = "<unset>"
-    scroll_bar_state: ScrollBar = field(default_factory=ScrollBar)
-    track_bar_state: TrackBar = field(default_factory=TrackBar)
-    bar_enabled: bool = False
-    groups_icon_enabled: bool = False
-    is_hi_enabled: bool = False
-    is_md_enabled: bool = False
-    battery: Battery = Battery(False, False, False, 0)
-    play_modes: list[str] = []
-    current_playback_glyph: str = ""
+if not __package__:
+    # Started as `python emulator.py` - make the sibling modules importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+
+from .state import State, StateHistory, apply_event
+from .ingest import EventServer
+from .shmring import ShmReceiver
+from .framebuffer import (
+    DEFAULT_COLOR, SCROLL_BAR_WIDTH, TOP_RESERVED_PX, TRACK_BAR_WIDTH, TRACK_BAR_HMARGIN, TRACK_BAR_STARTX,
+    ROW_HEIGHT, BASELINE,
+)
+from .glyphs import load_atlas
+from .journal import EventJournal, JournalReader, JournalView, read_event_chunks, write_json
+
+class RenderCache:
+    # Least recently used pixmaps - make(*args) renders the missing ones
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key, make, *args):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry
+        entry = self.entries[key] = make(*args)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return entry
+
+JOURNAL_DIR = os.path.join(tempfile.gettempdir(), 'rh10-emulator')
 
+# Without a journal (--no-journal), the events are only kept in memory
+journal = None
 current_state = State()
-states = []
-events = []
-
-def handle_event(event):
-    global current_state, states, events
-    events.append(event)
-    current_state.message = "Unset"
-    _type = event["type"]
-    if _type == "display":
-        row, col, data, clear_remain = event["row"], event["col"], event["data"], event["clearRemaining"]
-        start = current_state.screen_matrix[row].start
-        data = data[:current_state.screen_matrix[row].end - start]
-        if clear_remain:
-            # E0, E3
-            current_state.screen_matrix[row].data[col+start:] = data
-        else:
-            current_state.screen_matrix[row].data[col+start:col+len(data)] = data
-        current_state.message = f"Set {row=} to {data}"
-    if _type == "clear":
-        # HACK: Not sure if this is meant to work like this, or if there's a separate command to clear
-        # the track progress bar.
-        if current_state.track_bar_state.row in event['rows']:
-            current_state.track_bar_state.enabled = False
-        for row in event["rows"]:
-            current_state.screen_matrix[row].data = [''] * 20
-            current_state.screen_matrix[row].start = 0
-            current_state.screen_matrix[row].end = 0x19
-        current_state.message = f"Clear rows: {', '.join(str(x) for x in event['rows'])}"
-    if _type == "init":
-        current_state = State()
-        current_state.message = "init"
-        states = []
-    if _type == "invert":
-        rows = event["rows"]
-        current_state.message = f'Invert rows: {rows}'
-        #for row in range(6):
-            #if row in rows:
-                #current_state.screen_matrix[row].inverted = not current_state.screen_matrix[row].inverted
-            #else:
-                #current_state.screen_matrix[row].inverted = False
-        for row in range(6):
-            current_state.screen_matrix[row].inverted = row in rows
-    if _type == "scrollbar":
-        current_state.scroll_bar_state.from_px = event['from']
-        current_state.scroll_bar_state.to_px = event['to']
-        current_state.scroll_bar_state.enabled = event['enabled']
-        current_state.message = f'Update scroll bar {current_state.scroll_bar_state.from_px} => {current_state.scroll_bar_state.to_px}, enabled = {current_state.scroll_bar_state.enabled}'
-    if _type == "trackbar":
-        current_state.track_bar_state.enabled = event['enabled']
-        current_state.track_bar_state.to_px = event['to']
-        current_state.track_bar_state.from_px = event['from']
-        current_state.track_bar_state.row = event['rows']
-        current_state.message = f'Update track bar {current_state.track_bar_state.from_px} => {current_state.track_bar_state.to_px}, enabled = {current_state.track_bar_state.enabled}'
-    if _type == "bar":
-        current_state.bar_enabled = event['enabled']
-    if _type == "format":
-        current_state.is_hi_enabled = event['hi']
-        current_state.is_md_enabled = event['md']
-    if _type == "groups":
-        current_state.groups_icon_enabled = event['enabled']
-    if _type == "glyph":
-        current_state.current_playback_glyph = event['glyph']
-    if _type == "playmode":
-        current_state.play_modes = event['entries']
-    if _type == "limit":
-        for row in event['rows']:
-            current_state.screen_matrix[row].start = event['start']
-            current_state.screen_matrix[row].end = event['end']
-    states.append(deepcopy(current_state))
+history = StateHistory()
+
+def open_journal(directory = JOURNAL_DIR):
+    # Every event the emulator sees is appended to the session's journal as it arrives
+    global journal, history
+    os.makedirs(directory, exist_ok=True)
+    journal = EventJournal(os.path.join(directory, time.strftime("session-%Y%m%d-%H%M%S.journal")))
+    history = StateHistory(events=JournalView(journal))
+
+# Everything above is owned by the server's engine thread - the UI holds server.lock to read it,
+# and goes through server.submit to change it.
+def handle_events(new_events):
+    global current_state
+    for event in new_events:
+        if event["type"] == "init":
+            history.clear()
+        current_state = apply_event(current_state, event)
+        history.append(event, current_state)
+    if journal:
+        journal.flush()
+
+def handle_loaded_events(new_events, applied, errors):
+    # The loader waits for `applied` - set even if the chunk couldn't be applied, with the error in `errors`
+    try:
+        handle_events(new_events)
+    except Exception as e:
+        errors.append(e)
+        raise
+    finally:
+        applied.set()
+
+def handle_reset():
+    # Only the live state starts over, the history keeps the states seen so far
+    global current_state
+    event = {"type": "reset"}
+    current_state = apply_event(current_state, event)
+    history.append(event, current_state)
+
+def handle_full_reset():
+    global current_state
+    history.clear()
+    current_state = State()
+
+class UpdateNotifier(QtCore.QObject):
+    # Tells the UI that the history changed. Safe to call from any thread - the signal is delivered
+    # on the UI thread, and only once until the UI has picked it up, however many batches come in.
+    changed = QtCore.pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.pending = False
+
+    def notify(self):
+        if not self.pending:
+            self.pending = True
+            self.changed.emit()
+
+    def acknowledge(self):
+        self.pending = False
+
+notifier = UpdateNotifier()
+server = None
+shm_receiver = None
+
+def start_server():
+    # Once the window is listening to the notifier
+    global server, shm_receiver
+    server = EventServer(handle_events, on_applied=notifier.notify)
+    server.start()
+    # Decoders on this host can skip HTTP, with TRANSMIT_ADDRESS = "shm://rh10-emulator"
+    try:
+        shm_receiver = ShmReceiver(server.submit_events)
+        shm_receiver.start()
+    except OSError as e:
+        print(f"[Emulator]: No shared memory ring ({e}), only serving HTTP")
 
 class MainWindow(QtWidgets.QMainWindow):
     def __init__(self):
@@ -163,9 +129,25 @@ class MainWindow(QtWidgets.QMainWindow):
         self.currentEvent = 0
         self.setWindowTitle("Emulator")
 
-        self.timer = QtCore.QTimer()
-        self.timer.timeout.connect(self.check_for_update)
-        self.timer.start(100)
+        self.glyphs = load_atlas()
+        self.glyph_cache = RenderCache(2048)
+        self.row_cache = RenderCache(512)
+        self.bar_cache = RenderCache(512)
+        self.last_frame = None
+        self.loader = None
+        # Written by the loader thread, picked up by check_for_update
+        self.load_progress = None
+        self.load_message = None
+
+        # At most one render per display refresh, however fast the events come in
+        refresh_rate = QtGui.QGuiApplication.primaryScreen().refreshRate() or 60
+        self.frame_interval = 1 / refresh_rate
+        self.last_update = 0
+        self.frame_timer = QtCore.QTimer()
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setTimerType(Qt.PreciseTimer)
+        self.frame_timer.timeout.connect(self.check_for_update)
+        notifier.changed.connect(self.schedule_update)
 
         self.label = QtWidgets.QLabel()
         self.label.setAlignment(Qt.AlignHCenter | Qt.AlignTop)
@@ -189,24 +171,33 @@ class MainWindow(QtWidgets.QMainWindow):
         
         reset_state = QtWidgets.QPushButton("Reset")
         def _reset():
-            global current_state
-            current_state = State()
+            server.submit(handle_reset)
         reset_state.clicked.connect(_reset)
         reset_all_state = QtWidgets.QPushButton("Full Reset")
         def _reset_f():
-            global current_state, states
-            states = []
-            current_state = State()
+            server.submit(handle_full_reset)
         reset_all_state.clicked.connect(_reset_f)
         def dump_events():
-            with open("events", "w") as e:
-                json.dump(events, e)
+            if not journal:
+                with server.lock:
+                    events = history.events.slice(0, len(history))
+                with open("events", 'w') as f:
+                    json.dump(events, f)
+                self.statusBar().showMessage(f"Saved {len(events)} events", 5000)
+                return
+            # The journal already has everything - this converts it to the JSON "Load Events" reads
+            with server.lock:
+                journal.flush()
+                count = len(journal)
+            reader = JournalReader(journal.path)
+            write_json(reader, "events", count)
+            reader.close()
+            self.statusBar().showMessage(f"Saved {count} events (journal: {journal.path})", 5000)
         def load_events():
-            global events
-            with open("events", "r") as e:
-                events = json.load(e)
-                for q in events:
-                    handle_event(q)
+            if self.loader and self.loader.is_alive():
+                return
+            self.loader = threading.Thread(target=self.load_in_background, args=("events",), daemon=True)
+            self.loader.start()
         save_events_b = QtWidgets.QPushButton("Save Events")
         save_events_b.clicked.connect(dump_events)
         load_events_b = QtWidgets.QPushButton("Load Events")
@@ -222,17 +213,71 @@ class MainWindow(QtWidgets.QMainWindow):
         root.setLayout(layout)
         self.setCentralWidget(root)
         
+        self.progress = QtWidgets.QProgressBar()
+        self.progress.setMaximumWidth(150)
+        self.progress.setFormat("Loading %p%")
+        self.progress.hide()
+        self.statusBar().addPermanentWidget(self.progress)
         self.statusBar().show()
         self.update_counters()
+        # Anything applied before the signal was connected would otherwise never be picked up
+        notifier.acknowledge()
+        self.schedule_update()
+
+    def load_in_background(self, path):
+        # Parses the file a chunk at a time, and hands the chunks to the engine thread - one is
+        # parsed while the previous one is applied, so the history grows (and the slider with it)
+        # as the file is read.
+        loaded = 0
+        pending = None
+        errors = []
+        self.load_progress = 0
+        try:
+            for chunk, progress in read_event_chunks(path):
+                applied = threading.Event()
+                server.submit(handle_loaded_events, chunk, applied, errors)
+                if pending:
+                    pending.wait()
+                if errors:
+                    break
+                pending = applied
+                loaded += len(chunk)
+                self.load_progress = progress
+            if pending and not errors:
+                pending.wait()
+            if errors:
+                self.load_message = f"Couldn't load {path}: {errors[0]!r}"
+            else:
+                self.load_message = f"Loaded {loaded} events"
+        except (OSError, ValueError) as e:
+            self.load_message = f"Couldn't load {path}: {e}"
+        self.load_progress = None
+        notifier.notify()
+
+    def schedule_update(self):
+        notifier.acknowledge()
+        if not self.frame_timer.isActive():
+            wait = self.last_update + self.frame_interval - time.monotonic()
+            self.frame_timer.start(max(int(wait * 1000), 0))
 
     def check_for_update(self):
+        self.last_update = time.monotonic()
+        progress = self.load_progress
+        if progress is None:
+            self.progress.hide()
+        else:
+            self.progress.setValue(int(progress * 100))
+            self.progress.show()
         old_max = self.slider.maximum()
-        lstat = len(states)
+        lstat = len(history)
         if old_max != lstat:
             self.update_slider()
+        if self.load_message:
+            self.statusBar().showMessage(self.load_message, 5000)
+            self.load_message = None
         
     def update_counters(self):
-        lstat = len(states)
+        lstat = len(history)
         is_max = self.slider.maximum() == self.slider.value()
         self.currentEvent = self.slider.value()
         self.currentEvents.setText(str(self.currentEvent))
@@ -245,10 +290,10 @@ class MainWindow(QtWidgets.QMainWindow):
         self.update_counters()
         sval = self.slider.value()
         if sval == 0:
-            state = State()
+            self.render_state(State())
         else:
-            state = states[sval - 1]
-        self.render_state(state)
+            with server.lock:
+                self.render_state(history[sval - 1])
 
 
     def set_painter_color(self, painter, color = DEFAULT_COLOR):
@@ -258,78 +303,126 @@ class MainWindow(QtWidgets.QMainWindow):
         painter.setPen(pen)
 
 
-    def render_state(self, state: State):
-        self.canvas.fill(Qt.black)
-        painter = QtGui.QPainter(self.label.pixmap())
+    def render_glyph(self, glyph, color):
+        image = QtGui.QImage(glyph.width, len(glyph.rows), QtGui.QImage.Format_ARGB32)
+        image.fill(0)
+        pixel = QtGui.qRgb(*color)
+        for y, bits in enumerate(glyph.rows):
+            for x in range(glyph.width):
+                if bits & (1 << (glyph.width - 1 - x)):
+                    image.setPixel(x, y, pixel)
+        return QtGui.QPixmap.fromImage(image)
+
+    def render_row(self, data, inverted, scroll_bar_enabled):
+        pixmap = QtGui.QPixmap(128, ROW_HEIGHT)
+        pixmap.fill(Qt.transparent)
+        painter = QtGui.QPainter(pixmap)
+        color = DEFAULT_COLOR
+        if inverted:
+            invert_box_width = (128 - SCROLL_BAR_WIDTH - 1) if scroll_bar_enabled else 128
+            painter.fillRect(0, 0, invert_box_width, ROW_HEIGHT, QtGui.QColor(*DEFAULT_COLOR))
+            color = (0, 0, 0)
+        x = 0
+        for char in data:
+            glyph = self.glyphs.get(char)
+            if glyph:
+                if glyph.width:
+                    painter.drawPixmap(x + glyph.x, BASELINE + glyph.y, self.glyph_cache.get((char, color), self.render_glyph, glyph, color))
+                x += glyph.advance
+        painter.end()
+        return pixmap
+
+    def render_track_bar(self, row, from_px, to_px):
+        pixmap = QtGui.QPixmap(128, 96)
+        pixmap.fill(Qt.transparent)
+        painter = QtGui.QPainter(pixmap)
         painter.setRenderHint(QtGui.QPainter.Antialiasing)
-        painter.fillRect(0, 0, 128, 96, QtGui.QColor(0,0,0))
         self.set_painter_color(painter)
+        painter.drawRoundedRect(
+            TRACK_BAR_STARTX,
+            16 * row + TRACK_BAR_HMARGIN,
+            TRACK_BAR_WIDTH,
+            16 - TRACK_BAR_HMARGIN,
+            TRACK_BAR_HMARGIN, TRACK_BAR_HMARGIN
+        )
+        path = QtGui.QPainterPath()
+        path.addRoundedRect(
+            TRACK_BAR_STARTX,
+            16 * row + TRACK_BAR_HMARGIN + from_px - 1,
+            to_px - from_px + 1,
+            16 - TRACK_BAR_HMARGIN,
+            TRACK_BAR_HMARGIN, TRACK_BAR_HMARGIN
+        )
+        painter.fillPath(path, QtGui.QColor(*DEFAULT_COLOR))
+        painter.end()
+        return pixmap
 
-        # Is this line there permanently?
-        # No
-        if state.bar_enabled:
-            painter.drawLine(0, TOP_RESERVED_PX, 128, TOP_RESERVED_PX)
-        x, y = 0, TOP_RESERVED_PX
-        font = QtGui.QFont()
-        font.setFamily('monospace')
-        font.setBold(True)
-        font.setPointSize(8)
-        painter.setFont(font)
-
-        remaps = {
-            # A terrible way to convert to zenkaku numbers:
-            **dict((f"big {x}", chr(x+65296)) for x in range(10)),
-            "big :": ":",
-            "volume icon": "🔊",
-            "music note": "🎵",
-            "folder": "📁",
-            "minidisc": "💽",
-        }
-
-        for row in range(6):
-            if state.screen_matrix[row].inverted:
-                self.set_painter_color(painter, (0, 0, 0))
-                invert_box_width = (128 - SCROLL_BAR_WIDTH - 1) if state.scroll_bar_state.enabled else 128
-                painter.fillRect(x, y - 12, invert_box_width, 16, QtGui.QColor(*DEFAULT_COLOR))
-            for char in state.screen_matrix[row].data:
-                try:
-                    painter.drawText(x, y, remaps.get(char, char))
-                except Exception as e:
-                    print(e) 
-                x += 6
-            self.set_painter_color(painter)
-            y += 16
-            x = 0
-            
-        if state.track_bar_state.enabled:
-            self.set_painter_color(painter)
-            painter.drawRoundedRect(
-                TRACK_BAR_STARTX,
-                16 * state.track_bar_state.row + TRACK_BAR_HMARGIN,
-                TRACK_BAR_WIDTH,
-                16 - TRACK_BAR_HMARGIN,
-                TRACK_BAR_HMARGIN, TRACK_BAR_HMARGIN
-            )
-            path = QtGui.QPainterPath()
-            path.addRoundedRect(
-                TRACK_BAR_STARTX,
-                16 * state.track_bar_state.row + TRACK_BAR_HMARGIN + state.track_bar_state.from_px - 1,
-                state.track_bar_state.to_px - state.track_bar_state.from_px + 1,
-                16 - TRACK_BAR_HMARGIN,
-                TRACK_BAR_HMARGIN, TRACK_BAR_HMARGIN
-            )
-            painter.fillPath(path, QtGui.QColor(*DEFAULT_COLOR))
-
-        if state.scroll_bar_state.enabled:
-            painter.fillRect(128 - SCROLL_BAR_WIDTH, TOP_RESERVED_PX, 1, 96 - TOP_RESERVED_PX, QtGui.QColor(*DEFAULT_COLOR))
-            painter.fillRect(128 - SCROLL_BAR_WIDTH, state.scroll_bar_state.from_px + TOP_RESERVED_PX, SCROLL_BAR_WIDTH, state.scroll_bar_state.to_px - state.scroll_bar_state.from_px, QtGui.QColor(*DEFAULT_COLOR))
+    def render_scroll_bar(self, from_px, to_px):
+        pixmap = QtGui.QPixmap(128, 96)
+        pixmap.fill(Qt.transparent)
+        painter = QtGui.QPainter(pixmap)
+        painter.fillRect(128 - SCROLL_BAR_WIDTH, TOP_RESERVED_PX, 1, 96 - TOP_RESERVED_PX, QtGui.QColor(*DEFAULT_COLOR))
+        painter.fillRect(128 - SCROLL_BAR_WIDTH, from_px + TOP_RESERVED_PX, SCROLL_BAR_WIDTH, to_px - from_px, QtGui.QColor(*DEFAULT_COLOR))
         painter.end()
-        self.update()
+        return pixmap
+
+    def render_state(self, state: State):
+        # The frame is composited from cached layers - a pixmap per row, one per bar - and not
+        # repainted at all if none of them changed since the last one.
+        scroll_bar, track_bar = state.scroll_bar_state, state.track_bar_state
+        rows = tuple(
+            (tuple(row.data), row.inverted, scroll_bar.enabled and row.inverted)
+            for row in state.screen_matrix
+        )
+        track_key = (track_bar.row, track_bar.from_px, track_bar.to_px) if track_bar.enabled else None
+        scroll_key = (scroll_bar.from_px, scroll_bar.to_px) if scroll_bar.enabled else None
+        frame = (rows, state.bar_enabled, track_key, scroll_key)
+
+        if frame != self.last_frame:
+            self.last_frame = frame
+            painter = QtGui.QPainter(self.label.pixmap())
+            painter.setRenderHint(QtGui.QPainter.Antialiasing)
+            painter.fillRect(0, 0, 128, 96, QtGui.QColor(0,0,0))
+            self.set_painter_color(painter)
+
+            # Is this line there permanently?
+            # No
+            if state.bar_enabled:
+                painter.drawLine(0, TOP_RESERVED_PX, 128, TOP_RESERVED_PX)
+            y = 0
+            for key in rows:
+                painter.drawPixmap(0, y, self.row_cache.get(key, self.render_row, *key))
+                y += ROW_HEIGHT
+            if track_key:
+                painter.drawPixmap(0, 0, self.bar_cache.get(('track', *track_key), self.render_track_bar, *track_key))
+            if scroll_key:
+                painter.drawPixmap(0, 0, self.bar_cache.get(('scroll', *scroll_key), self.render_scroll_bar, *scroll_key))
+            painter.end()
+            self.update()
         self.statusBar().showMessage(state.message, 2000)
         
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Emulator of the RH10/RH910 display")
+    parser.add_argument("--live", default=None, help="Also decode the live stream from this serial device / pty, or tcp://host:port")
+    parser.add_argument("--baud", type=int, default=None, help="Baud rate of the --live serial device")
+    parser.add_argument("--journal-dir", default=JOURNAL_DIR, help="Directory the session journals are written to")
+    parser.add_argument("--no-journal", action="store_true", help="Only keep the events in memory")
+    args = parser.parse_args()
+    if not args.no_journal:
+        open_journal(args.journal_dir)
     app = QtWidgets.QApplication( [] )
     window = MainWindow()
+    start_server()
+    if args.live:
+        from .live import LiveDecoder
+        server.submit_events([{"type": "init"}])
+        LiveDecoder(args.live, handle_events=server.submit_events, baud=args.baud).start()
     window.show()
     app.exec_()
+    if shm_receiver:
+        shm_receiver.close()
+    if journal:
+        with server.lock:
+            journal.close()
     
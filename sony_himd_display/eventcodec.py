@@ -0,0 +1,124 @@
+import struct
+import json
+
+# Compact binary encoding of the emulator events, for storing and shipping them without JSON.
+# An event is one byte for its type, then the values of that type's fields in the order below.
+# Events which don't match their schema exactly are stored as JSON, so nothing is ever lost.
+#
+# Values are tagged: a tag byte, then
+#   INT - zigzag LEB128, STR - LEB128 length + UTF-8, LIST - LEB128 count + the items, FLOAT - f64
+
+EVENT_SCHEMAS = (
+    ("init", ()),
+    ("reset", ()),
+    ("display", ("row", "col", "data", "clearRemaining")),
+    ("clear", ("rows",)),
+    ("invert", ("rows",)),
+    ("scrollbar", ("from", "to", "enabled")),
+    ("trackbar", ("from", "to", "enabled", "rows")),
+    ("bar", ("enabled",)),
+    ("format", ("hi", "md")),
+    ("groups", ("enabled",)),
+    ("glyph", ("glyph",)),
+    ("playmode", ("entries",)),
+    ("limit", ("start", "end", "rows")),
+    ("battery", ("isCharging", "outlineEnabled", "tiles")),
+)
+EVENT_TYPES = dict((name, (code, fields)) for code, (name, fields) in enumerate(EVENT_SCHEMAS))
+JSON_EVENT = 0xFF
+
+NONE, FALSE, TRUE, INT, STR, LIST, FLOAT = range(7)
+FLOAT_VALUE = struct.Struct('<d')
+
+def encode_varint(value, out):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, pos
+        shift += 7
+
+def encode_value(value, out):
+    if value is None:
+        out.append(NONE)
+    elif value is True:
+        out.append(TRUE)
+    elif value is False:
+        out.append(FALSE)
+    elif isinstance(value, int):
+        out.append(INT)
+        encode_varint(value << 1 if value >= 0 else (-value << 1) - 1, out)
+    elif isinstance(value, str):
+        encoded = value.encode('utf-8')
+        out.append(STR)
+        encode_varint(len(encoded), out)
+        out += encoded
+    elif isinstance(value, (list, tuple)):
+        out.append(LIST)
+        encode_varint(len(value), out)
+        for item in value:
+            encode_value(item, out)
+    elif isinstance(value, float):
+        out.append(FLOAT)
+        out += FLOAT_VALUE.pack(value)
+    else:
+        raise TypeError(f"Can't encode {type(value).__name__}")
+
+def decode_value(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == STR:
+        length, pos = decode_varint(data, pos)
+        return str(data[pos:pos + length], 'utf-8'), pos + length
+    if tag == INT:
+        value, pos = decode_varint(data, pos)
+        return (value >> 1) ^ -(value & 1), pos
+    if tag == LIST:
+        count, pos = decode_varint(data, pos)
+        items = []
+        for _ in range(count):
+            item, pos = decode_value(data, pos)
+            items.append(item)
+        return items, pos
+    if tag == TRUE:
+        return True, pos
+    if tag == FALSE:
+        return False, pos
+    if tag == NONE:
+        return None, pos
+    if tag == FLOAT:
+        return FLOAT_VALUE.unpack_from(data, pos)[0], pos + FLOAT_VALUE.size
+    raise ValueError(f"Unknown value tag {tag}")
+
+def encode_event(event):
+    schema = EVENT_TYPES.get(event.get("type"))
+    if schema and len(event) == len(schema[1]) + 1:
+        code, fields = schema
+        out = bytearray((code,))
+        try:
+            for field in fields:
+                encode_value(event[field], out)
+            return bytes(out)
+        except (KeyError, TypeError):
+            pass
+    return bytes((JSON_EVENT,)) + json.dumps(event, separators=(',', ':')).encode('utf-8')
+
+def decode_event(data):
+    code = data[0]
+    if code == JSON_EVENT:
+        return json.loads(bytes(data[1:]))
+    name, fields = EVENT_SCHEMAS[code]
+    event = {"type": name}
+    pos = 1
+    for field in fields:
+        event[field], pos = decode_value(data, pos)
+    return event
@@ -0,0 +1,249 @@
+import struct
+import pickle
+import zlib
+import sys
+import os
+
+from .state import State, StateHistory, apply_event
+from .framebuffer import WIDTH, HEIGHT, PALETTE, render_state
+from .glyphs import load_atlas
+from .journal import JournalReader, is_journal, history_from_journal, read_events
+from .parallel import ordered_map
+
+# Headless export of an emulator timeline - one 128x96 frame per event, as a PNG sequence, an
+# animated GIF, or raw RGB24 frames (for `ffmpeg -f rawvideo -pix_fmt rgb24 -s 128x96`).
+# The frames are rendered in ranges on a process pool. Every range starts from one of the
+# StateHistory keyframes, so no worker has to replay the timeline from the beginning.
+
+FORMATS = ('png', 'gif', 'raw')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+GIF_MIN_CODE_SIZE = 2
+GIF_MAX_CODE = 4095
+
+glyphs = None
+
+def get_glyphs():
+    global glyphs
+    if glyphs is None:
+        glyphs = load_atlas()
+    return glyphs
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+def encode_png(fb, palette = PALETTE):
+    # 1-bit paletted - the framebuffer rows are already in the right bit order
+    header = struct.pack('>IIBBBBB', WIDTH, HEIGHT, 1, 3, 0, 0, 0)
+    scanlines = b''.join(b'\0' + row.to_bytes(WIDTH // 8, 'big') for row in fb.rows)
+    return (
+        PNG_SIGNATURE +
+        png_chunk(b'IHDR', header) +
+        png_chunk(b'PLTE', b''.join(bytes(x) for x in palette)) +
+        png_chunk(b'IDAT', zlib.compress(scanlines, 9)) +
+        png_chunk(b'IEND', b'')
+    )
+
+def lzw_encode(pixels, min_code_size = GIF_MIN_CODE_SIZE):
+    # GIF flavoured LZW: variable code width, LSB first, a clear code once the table is full
+    clear = 1 << min_code_size
+    end_of_information = clear + 1
+    out = bytearray()
+    buffer = 0
+    bits = 0
+    code_size = min_code_size + 1
+    next_code = end_of_information + 1
+    table = {}
+
+    def emit(code):
+        nonlocal buffer, bits
+        buffer |= code << bits
+        bits += code_size
+        while bits >= 8:
+            out.append(buffer & 0xFF)
+            buffer >>= 8
+            bits -= 8
+
+    emit(clear)
+    prefix = pixels[0]
+    for pixel in pixels[1:]:
+        key = (prefix << 8) | pixel
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        emit(prefix)
+        if next_code <= GIF_MAX_CODE:
+            table[key] = next_code
+            next_code += 1
+            if next_code > (1 << code_size) and code_size < 12:
+                code_size += 1
+        else:
+            emit(clear)
+            table.clear()
+            code_size = min_code_size + 1
+            next_code = end_of_information + 1
+        prefix = pixel
+    emit(prefix)
+    emit(end_of_information)
+    if bits:
+        out.append(buffer & 0xFF)
+    return bytes(out)
+
+def gif_sub_blocks(data):
+    return b''.join(bytes([len(data[i:i + 255])]) + data[i:i + 255] for i in range(0, len(data), 255)) + b'\0'
+
+def gif_header(palette = PALETTE):
+    return (
+        b'GIF89a' +
+        struct.pack('<HHBBB', WIDTH, HEIGHT, 0x80, 0, 0) +
+        b''.join(bytes(x) for x in palette) +
+        # Loop forever
+        b'\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00'
+    )
+
+GIF_TRAILER = b'\x3b'
+
+def changed_area(fb, previous):
+    # (left, top, width, height) of the pixels which differ from `previous`
+    if previous is None:
+        return 0, 0, WIDTH, HEIGHT
+    changed = [y for y in range(HEIGHT) if fb.rows[y] != previous.rows[y]]
+    if not changed:
+        return 0, 0, 1, 1
+    diff = 0
+    for y in changed:
+        diff |= fb.rows[y] ^ previous.rows[y]
+    left = WIDTH - diff.bit_length()
+    right = WIDTH - ((diff & -diff).bit_length() - 1)
+    return left, changed[0], right - left, changed[-1] + 1 - changed[0]
+
+def encode_gif_frame(fb, previous, delay):
+    # Only the area which changed since the previous frame is stored, the rest is left in place
+    left, top, width, height = changed_area(fb, previous)
+    indices = fb.indices()
+    pixels = b''.join(indices[y * WIDTH + left:y * WIDTH + left + width] for y in range(top, top + height))
+    return (
+        struct.pack('<BBBBHBB', 0x21, 0xf9, 4, 1 << 2, delay, 0, 0) +
+        struct.pack('<BHHHHB', 0x2c, left, top, width, height, 0) +
+        bytes([GIF_MIN_CODE_SIZE]) + gif_sub_blocks(lzw_encode(pixels))
+    )
+
+def render_range(task):
+    # Runs on the workers: replays `events` on top of `keyframe` (the pickled state after event
+    # `index`), and returns the encoded frames for the events first <= index < end.
+    keyframe, events, index, first, end, fmt, skip_unchanged, delay = task
+    state = pickle.loads(keyframe)
+    glyphs = get_glyphs()
+    frames = []
+    previous = None
+    first_key = None
+    events = iter(events)
+    while True:
+        if index >= first:
+            fb = render_state(state, glyphs)
+            if not (skip_unchanged and previous and fb.rows == previous.rows):
+                if fmt == 'png':
+                    frames.append((index, encode_png(fb)))
+                elif fmt == 'gif':
+                    frames.append((index, encode_gif_frame(fb, previous, delay)))
+                else:
+                    frames.append((index, fb.rgb()))
+                if first_key is None:
+                    first_key = fb.key()
+            previous = fb
+        index += 1
+        if index >= end:
+            break
+        state = apply_event(state, next(events))
+    return frames, first_key, previous.key() if previous else None
+
+def history_from_events(events, keyframe_interval = 256):
+    history = StateHistory(keyframe_interval)
+    state = State()
+    for event in events:
+        state = apply_event(state, event)
+        history.append(event, state)
+    return history
+
+def range_tasks(history, first, end, chunk_size, fmt, skip_unchanged, delay):
+    interval = history.keyframe_interval
+    chunk_size = max(chunk_size // interval, 1) * interval
+    start = first // interval * interval
+    while start < end:
+        stop = min(start + chunk_size, end)
+        keyframe = history.keyframes[start // interval]
+        yield (keyframe, history.events.slice(start + 1, stop), start, max(first, start), stop, fmt, skip_unchanged, delay)
+        start = stop
+
+def export_history(history, output, fmt = 'png', first = 0, last = None, jobs = None, chunk_size = 4096, skip_unchanged = False, delay = 5):
+    # Frame i is the state after event i. `delay` is the time per GIF frame, in 1/100s.
+    # Returns the number of frames written.
+    end = len(history) if last is None else min(last + 1, len(history))
+    if first >= end:
+        return 0
+    jobs = jobs or os.cpu_count() or 1
+    tasks = range_tasks(history, first, end, chunk_size, fmt, skip_unchanged, delay)
+
+    if fmt == 'png':
+        os.makedirs(output, exist_ok=True)
+        handle = None
+    else:
+        handle = open(output, 'wb')
+        if fmt == 'gif':
+            handle.write(gif_header())
+
+    written = 0
+    last_key = None
+    for frames, first_key, range_last_key in ordered_map(render_range, tasks, jobs):
+        if skip_unchanged and frames and first_key == last_key:
+            # Same as the last frame of the previous range
+            frames = frames[1:]
+        if range_last_key is not None:
+            last_key = range_last_key
+        for index, data in frames:
+            if handle:
+                handle.write(data)
+            else:
+                with open(os.path.join(output, f'frame_{index:06}.png'), 'wb') as f:
+                    f.write(data)
+        written += len(frames)
+
+    if handle:
+        if fmt == 'gif':
+            handle.write(GIF_TRAILER)
+        handle.close()
+    return written
+
+def guess_format(output):
+    extension = os.path.splitext(output)[1].lower()
+    if extension == '.gif':
+        return 'gif'
+    if extension in ('.raw', '.rgb'):
+        return 'raw'
+    return 'png'
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Render the frames of an events file saved by the emulator, without a display")
+    parser.add_argument("events", help="Event journal, or events file (the emulator's \"Save Events\")")
+    parser.add_argument("output", help="Directory for a PNG sequence, or a .gif / .raw file")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="Output format (guessed from the output name by default)")
+    parser.add_argument("--first", type=int, default=0, help="First event to render")
+    parser.add_argument("--last", type=int, default=None, help="Last event to render")
+    parser.add_argument("--jobs", type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--chunk", type=int, default=4096, help="Frames per worker task")
+    parser.add_argument("--skip-unchanged", action="store_true", help="Leave out frames identical to the previous one")
+    parser.add_argument("--delay", type=int, default=50, help="Milliseconds per GIF frame")
+    args = parser.parse_args()
+    if is_journal(args.events):
+        history = history_from_journal(JournalReader(args.events))
+    else:
+        history = history_from_events(read_events(args.events))
+    fmt = args.format or guess_format(args.output)
+    written = export_history(history, args.output, fmt, args.first, args.last, args.jobs, args.chunk, args.skip_unchanged, max(args.delay // 10, 1))
+    print(f"Wrote {written} frames", file=sys.stderr)
+    if fmt == 'raw':
+        print(f"Play with: ffplay -f rawvideo -pixel_format rgb24 -video_size {WIDTH}x{HEIGHT} {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+from dataclasses import dataclass
+from typing import Tuple
+import math
+
+# Renders emulator states to a 128x96 1-bit framebuffer, with the same layout as the Qt emulator -
+# for exporting frames without a display. Pixel rows are Python ints, the leftmost pixel in the
+# most significant bit, so that drawing a glyph row or a span is a single shift and OR.
+
+WIDTH = 128
+HEIGHT = 96
+FULL_ROW = (1 << WIDTH) - 1
+
+BACKGROUND_COLOR = (0, 0, 0)
+DEFAULT_COLOR = (0, 101, 184)
+PALETTE = (BACKGROUND_COLOR, DEFAULT_COLOR)
+
+SCROLL_BAR_WIDTH = 6
+TOP_RESERVED_PX = 15
+TRACK_BAR_WIDTH = 65
+TRACK_BAR_HMARGIN = 5
+TRACK_BAR_STARTX = 60 #?
+ROW_HEIGHT = 16
+# The baseline of the text, from the top of its row - where the firmware puts the cursor
+BASELINE = ROW_HEIGHT - 2
+
+@dataclass(frozen = True)
+class Glyph:
+    # Offset of the bitmap's top left corner from the pen position on the baseline
+    x: int
+    y: int
+    width: int
+    # One int per pixel row, the leftmost pixel in the most significant of `width` bits
+    rows: Tuple[int, ...]
+    # How far the pen moves after the glyph
+    advance: int
+
+def span(x0, x1):
+    # Mask of the pixels x0 <= x < x1
+    x0, x1 = max(x0, 0), min(x1, WIDTH)
+    if x1 <= x0:
+        return 0
+    return ((1 << (x1 - x0)) - 1) << (WIDTH - x1)
+
+class Framebuffer:
+    def __init__(self):
+        self.rows = [0] * HEIGHT
+
+    def key(self):
+        return tuple(self.rows)
+
+    def fill_rect(self, x, y, w, h, on = True):
+        mask = span(x, x + w)
+        for row in range(max(y, 0), min(y + h, HEIGHT)):
+            if on:
+                self.rows[row] |= mask
+            else:
+                self.rows[row] &= ~mask
+
+    def rounded_spans(self, x, y, w, h, r):
+        # (row, mask) of a filled rounded rectangle
+        r = min(r, w / 2, h / 2)
+        for dy in range(h):
+            edge = min(dy + 0.5, h - dy - 0.5)
+            inset = 0
+            if edge < r:
+                inset = round(r - math.sqrt(r * r - (r - edge) ** 2))
+            yield y + dy, span(x + inset, x + w - inset)
+
+    def fill_rounded_rect(self, x, y, w, h, r):
+        for row, mask in self.rounded_spans(x, y, w, h, r):
+            if 0 <= row < HEIGHT:
+                self.rows[row] |= mask
+
+    def draw_rounded_rect(self, x, y, w, h, r):
+        # 1px outline around (x, y, w, h), covering w + 1 by h + 1 pixels like QPainter.drawRoundedRect
+        inner = dict(self.rounded_spans(x + 1, y + 1, w - 1, h - 1, r - 1))
+        for row, mask in self.rounded_spans(x, y, w + 1, h + 1, r):
+            if 0 <= row < HEIGHT:
+                self.rows[row] |= mask & ~inner.get(row, 0)
+
+    def blit(self, glyph, x, y, on = True):
+        x += glyph.x
+        y += glyph.y
+        shift = WIDTH - x - glyph.width
+        for i, bits in enumerate(glyph.rows):
+            row = y + i
+            if not 0 <= row < HEIGHT or not bits:
+                continue
+            mask = (bits << shift if shift >= 0 else bits >> -shift) & FULL_ROW
+            if on:
+                self.rows[row] |= mask
+            else:
+                self.rows[row] &= ~mask
+
+    def packed(self):
+        # 1 bit per pixel, MSB first - 16 bytes per row
+        return b''.join(row.to_bytes(WIDTH // 8, 'big') for row in self.rows)
+
+    def indices(self):
+        # 1 byte (palette index) per pixel
+        return b''.join(INDEX_TABLE[b] for b in self.packed())
+
+    def rgb(self, palette = PALETTE):
+        return b''.join(RGB_TABLES[palette][b] for b in self.packed())
+
+def expand_byte(b, off, on):
+    return b''.join(on if b & (0x80 >> i) else off for i in range(8))
+
+# A packed byte => its 8 pixels
+INDEX_TABLE = [expand_byte(b, b'\0', b'\1') for b in range(256)]
+
+class RGBTables(dict):
+    def __missing__(self, palette):
+        off, on = bytes(palette[0]), bytes(palette[1])
+        table = self[palette] = [expand_byte(b, off, on) for b in range(256)]
+        return table
+
+RGB_TABLES = RGBTables()
+
+def render_state(state, glyphs):
+    # `glyphs.get(char)` returns the Glyph for one of the screen matrix entries, or None
+    # (glyphs.GlyphAtlas - the firmware's font)
+    fb = Framebuffer()
+    if state.bar_enabled:
+        fb.fill_rect(0, TOP_RESERVED_PX, WIDTH, 1)
+    scroll_bar, track_bar = state.scroll_bar_state, state.track_bar_state
+    top = 0
+    for row in state.screen_matrix:
+        on = True
+        if row.inverted:
+            invert_box_width = (WIDTH - SCROLL_BAR_WIDTH - 1) if scroll_bar.enabled else WIDTH
+            fb.fill_rect(0, top, invert_box_width, ROW_HEIGHT)
+            on = False
+        x = 0
+        for char in row.data:
+            glyph = glyphs.get(char)
+            if glyph:
+                fb.blit(glyph, x, top + BASELINE, on)
+                x += glyph.advance
+        top += ROW_HEIGHT
+
+    if track_bar.enabled:
+        fb.draw_rounded_rect(
+            TRACK_BAR_STARTX,
+            16 * track_bar.row + TRACK_BAR_HMARGIN,
+            TRACK_BAR_WIDTH,
+            16 - TRACK_BAR_HMARGIN,
+            TRACK_BAR_HMARGIN
+        )
+        fb.fill_rounded_rect(
+            TRACK_BAR_STARTX,
+            16 * track_bar.row + TRACK_BAR_HMARGIN + track_bar.from_px - 1,
+            track_bar.to_px - track_bar.from_px + 1,
+            16 - TRACK_BAR_HMARGIN,
+            TRACK_BAR_HMARGIN
+        )
+
+    if scroll_bar.enabled:
+        fb.fill_rect(WIDTH - SCROLL_BAR_WIDTH, TOP_RESERVED_PX, 1, HEIGHT - TOP_RESERVED_PX)
+        fb.fill_rect(WIDTH - SCROLL_BAR_WIDTH, scroll_bar.from_px + TOP_RESERVED_PX, SCROLL_BAR_WIDTH, scroll_bar.to_px - scroll_bar.from_px)
+    return fb
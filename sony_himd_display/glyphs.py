@@ -0,0 +1,250 @@
+from array import array
+import hashlib
+import struct
+import sys
+import re
+import os
+
+from .core import SPECIAL_SJIS_SEQUENCES
+from .framebuffer import Glyph
+
+# The glyphs of the hardware clone (rh10screen/), for rendering pixel-identical frames:
+# font.h is a u8g2 font, convtable.h the table it uses to turn Shift-JIS into unicode.
+# The parsed atlas is cached in __pycache__, and rebuilt whenever the headers change.
+
+FIRMWARE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rh10screen')
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__', 'rh10_glyph_atlas.bin')
+FONT_HEADER = 'font.h'
+CONV_TABLE_HEADER = 'convtable.h'
+
+ATLAS_MAGIC = b'RH10ATL1'
+ATLAS_HEADER = struct.Struct('<20sHI')
+ATLAS_GLYPH = struct.Struct('<HbbBBb')
+
+U8G2_HEADER_SIZE = 23
+# Where the firmware puts the special Sony characters - FD xx => 0x10xx, FA xx => 0x11xx
+SPECIAL_CODEPOINTS = {0xFD: 0x1000, 0xFA: 0x1100}
+
+def parse_c_string(source):
+    # The bytes of the (concatenated) string literal initializing the array, with the terminating NUL
+    body = source[source.index('=') + 1:source.rindex(';')]
+    out = bytearray()
+    for literal in re.findall(r'"((?:[^"\\]|\\.)*)"', body):
+        i = 0
+        while i < len(literal):
+            char = literal[i]
+            if char != '\\':
+                out += char.encode('latin1')
+                i += 1
+                continue
+            octal = re.match(r'[0-7]{1,3}', literal[i + 1:i + 4])
+            if octal:
+                out.append(int(octal.group(), 8))
+                i += 1 + len(octal.group())
+            else:
+                out += {'n': b'\n', 't': b'\t', 'r': b'\r'}.get(literal[i + 1], literal[i + 1].encode('latin1'))
+                i += 2
+    out.append(0)
+    return bytes(out)
+
+def parse_c_bytes(source):
+    body = source[source.index('=') + 1:source.rindex(';')]
+    return bytes(int(x, 16) for x in re.findall(r'0x([0-9a-fA-F]{1,2})', body))
+
+class FontBits:
+    # u8g2 glyph bitstream - fields are read LSB first
+    def __init__(self, data, offset):
+        self.data = data
+        self.offset = offset
+        self.bit = 0
+
+    def unsigned(self, count):
+        value = self.data[self.offset] >> self.bit
+        end = self.bit + count
+        if end >= 8:
+            self.offset += 1
+            value |= self.data[self.offset] << (8 - self.bit)
+            end -= 8
+        self.bit = end
+        return value & ((1 << count) - 1)
+
+    def signed(self, count):
+        return self.unsigned(count) - (1 << (count - 1))
+
+def decode_glyph(font, offset):
+    (bits_per_0, bits_per_1, bits_per_width, bits_per_height,
+     bits_per_x, bits_per_y, bits_per_dx) = font[2:9]
+    bits = FontBits(font, offset)
+    width = bits.unsigned(bits_per_width)
+    height = bits.unsigned(bits_per_height)
+    x = bits.signed(bits_per_x)
+    y = bits.signed(bits_per_y)
+    advance = bits.signed(bits_per_dx)
+    rows = [0] * height
+    if width:
+        # Runs of background and foreground pixels, wrapping around at the glyph width
+        px, py = 0, 0
+        while py < height:
+            background = bits.unsigned(bits_per_0)
+            foreground = bits.unsigned(bits_per_1)
+            while True:
+                for length, on in ((background, False), (foreground, True)):
+                    while length:
+                        count = min(length, width - px)
+                        if on and py < height:
+                            rows[py] |= ((1 << count) - 1) << (width - px - count)
+                        px += count
+                        length -= count
+                        if px == width:
+                            px = 0
+                            py += 1
+                if not bits.unsigned(1):
+                    break
+    # The bitmap's top is (h + y) above the baseline
+    return Glyph(x, -(height + y), width, tuple(rows), advance)
+
+def parse_u8g2_font(font):
+    # Returns {codepoint: Glyph}
+    glyphs = {}
+    offset = U8G2_HEADER_SIZE
+    while font[offset + 1]:
+        glyphs[font[offset]] = decode_glyph(font, offset + 2)
+        offset += font[offset + 1]
+
+    # The unicode glyphs come after a jump table, which ends with 0xFFFF
+    offset = U8G2_HEADER_SIZE + struct.unpack_from('>H', font, 21)[0]
+    while True:
+        _, last = struct.unpack_from('>HH', font, offset)
+        offset += 4
+        if last == 0xFFFF:
+            break
+    while True:
+        codepoint, = struct.unpack_from('>H', font, offset)
+        if not codepoint:
+            break
+        glyphs[codepoint] = decode_glyph(font, offset + 3)
+        offset += font[offset + 2]
+    return glyphs
+
+class GlyphAtlas:
+    # `get(char)` maps an entry of the emulator's screen matrix to the glyph the firmware would draw.
+    def __init__(self, glyphs, conv_table):
+        self.glyphs = glyphs
+        # Big endian in the firmware
+        self.conv_table = array('H', conv_table)
+        if sys.byteorder == 'little':
+            self.conv_table.byteswap()
+        self.special = {}
+        for prefix, namespace in SPECIAL_SJIS_SEQUENCES.items():
+            for byte, name in namespace.items():
+                self.special[name] = SPECIAL_CODEPOINTS[prefix] | byte
+        self.cache = {}
+
+    def sjis_to_unicode(self, encoded):
+        # The same lookup as sj2utf8() in the firmware
+        section = encoded[0] >> 4
+        index = {0x8: 0x100, 0x9: 0x1100, 0xE: 0x2100}.get(section, 0)
+        if index:
+            if len(encoded) < 2:
+                return None
+            index += (encoded[0] & 0xF) << 8
+            encoded = encoded[1:]
+        index += encoded[0]
+        return self.conv_table[index] if index < len(self.conv_table) else None
+
+    def codepoint(self, char):
+        if char == '':
+            # Rows start out as spaces on the firmware
+            return 0x20
+        if char in self.special:
+            return self.special[char]
+        if len(char) != 1:
+            # Unknown special sequence, named after its bytes - "fd71"
+            try:
+                prefix, byte = int(char[:2], 16), int(char[2:], 16)
+            except ValueError:
+                return None
+            return SPECIAL_CODEPOINTS[prefix] | byte if prefix in SPECIAL_CODEPOINTS else None
+        try:
+            return self.sjis_to_unicode(char.encode('sjis'))
+        except UnicodeEncodeError:
+            return ord(char)
+
+    def get(self, char):
+        # None for the characters the font doesn't have - the firmware skips those without advancing
+        try:
+            return self.cache[char]
+        except KeyError:
+            glyph = self.cache[char] = self.glyphs.get(self.codepoint(char))
+            return glyph
+
+def source_digest(firmware_dir):
+    digest = hashlib.sha1()
+    for name in (FONT_HEADER, CONV_TABLE_HEADER):
+        with open(os.path.join(firmware_dir, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.digest()
+
+def build_atlas(firmware_dir = FIRMWARE_DIR):
+    with open(os.path.join(firmware_dir, FONT_HEADER), encoding='latin1') as f:
+        glyphs = parse_u8g2_font(parse_c_string(f.read()))
+    with open(os.path.join(firmware_dir, CONV_TABLE_HEADER), encoding='latin1') as f:
+        conv_table = parse_c_bytes(f.read())
+    return glyphs, conv_table
+
+def save_atlas(path, digest, glyphs, conv_table):
+    out = [ATLAS_MAGIC, ATLAS_HEADER.pack(digest, len(glyphs), len(conv_table)), conv_table]
+    for codepoint, glyph in sorted(glyphs.items()):
+        height = len(glyph.rows)
+        out.append(ATLAS_GLYPH.pack(codepoint, glyph.x, glyph.y, glyph.width, height, glyph.advance))
+        row_bytes = (glyph.width + 7) // 8
+        # Left aligned in whole bytes
+        out += [(row << (row_bytes * 8 - glyph.width)).to_bytes(row_bytes, 'big') for row in glyph.rows]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(b''.join(out))
+    os.replace(path + '.tmp', path)
+
+def read_atlas(path):
+    # Returns (digest, glyphs, conv_table)
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(ATLAS_MAGIC)] != ATLAS_MAGIC:
+        raise ValueError(f"{path} is not a glyph atlas")
+    offset = len(ATLAS_MAGIC)
+    digest, count, conv_length = ATLAS_HEADER.unpack_from(data, offset)
+    offset += ATLAS_HEADER.size
+    conv_table = data[offset:offset + conv_length]
+    offset += conv_length
+    glyphs = {}
+    for _ in range(count):
+        codepoint, x, y, width, height, advance = ATLAS_GLYPH.unpack_from(data, offset)
+        offset += ATLAS_GLYPH.size
+        row_bytes = (width + 7) // 8
+        rows = []
+        for _ in range(height):
+            rows.append(int.from_bytes(data[offset:offset + row_bytes], 'big') >> (row_bytes * 8 - width))
+            offset += row_bytes
+        glyphs[codepoint] = Glyph(x, y, width, tuple(rows), advance)
+    return digest, glyphs, conv_table
+
+def load_atlas(firmware_dir = FIRMWARE_DIR, cache_path = CACHE_PATH):
+    # The cache is rebuilt whenever the headers change. Without the headers (the decoder installed on
+    # its own) an existing cache is still used.
+    try:
+        digest = source_digest(firmware_dir)
+    except FileNotFoundError:
+        digest = None
+    try:
+        cached_digest, glyphs, conv_table = read_atlas(cache_path)
+        if digest is None or cached_digest == digest:
+            return GlyphAtlas(glyphs, conv_table)
+    except (OSError, ValueError, struct.error):
+        if digest is None:
+            raise FileNotFoundError(f"No glyph atlas cached, and no firmware headers in {firmware_dir}")
+    glyphs, conv_table = build_atlas(firmware_dir)
+    try:
+        save_atlas(cache_path, digest, glyphs, conv_table)
+    except OSError as e:
+        print(f"[Glyphs]: Couldn't cache the glyph atlas: {e}")
+    return GlyphAtlas(glyphs, conv_table)
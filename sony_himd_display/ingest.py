@@ -0,0 +1,174 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+import queue
+import json
+
+# The emulator's event endpoint, without any Qt in it.
+# A POST body is either one JSON event, a JSON list of events, or NDJSON (one event per line) -
+# sent with a Content-Length, or streamed with chunked transfer encoding. NDJSON events are handed
+# over as they arrive, so a single long-running request can feed the emulator for a whole session.
+# Requests are served on their own threads; all of them queue the events for one state engine thread.
+
+EMULATOR_ADDRESS = ('localhost', 36002)
+NDJSON_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-seq')
+READ_SIZE = 64 * 1024
+# How many queued items the engine applies per acquisition of the state lock
+ENGINE_BATCH = 1024
+
+def read_chunked(rfile):
+    # Yields the chunks of a body sent with "Transfer-Encoding: chunked"
+    while True:
+        size_line = rfile.readline(1024)
+        if not size_line:
+            raise ConnectionError("Connection closed in the middle of a chunked body")
+        size = int(size_line.split(b';')[0].strip(), 16)
+        if size == 0:
+            # Skip the trailers
+            while rfile.readline(1024) not in (b'\r\n', b'\n', b''):
+                pass
+            return
+        chunk = rfile.read(size)
+        if len(chunk) != size:
+            raise ConnectionError("Connection closed in the middle of a chunk")
+        rfile.readline(1024)
+        yield chunk
+
+def read_sized(rfile, length):
+    while length > 0:
+        block = rfile.read(min(length, READ_SIZE))
+        if not block:
+            raise ConnectionError(f"Connection closed with {length} bytes of the body missing")
+        length -= len(block)
+        yield block
+
+class NDJSONDecoder:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def parse_line(self, line, events):
+        line = line.strip()
+        if not line:
+            return
+        data = json.loads(line)
+        if isinstance(data, list):
+            events.extend(data)
+        else:
+            events.append(data)
+
+    def feed(self, data):
+        # Returns the events completed by `data`
+        events = []
+        self.buffer += data
+        end = self.buffer.rfind(b'\n')
+        if end == -1:
+            return events
+        for line in bytes(self.buffer[:end]).split(b'\n'):
+            self.parse_line(line, events)
+        del self.buffer[:end + 1]
+        return events
+
+    def finish(self):
+        events = []
+        self.parse_line(bytes(self.buffer), events)
+        self.buffer.clear()
+        return events
+
+class EventRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that the decoder can keep its connection open
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, code = '-', size = '-'):
+        # Only the failures - the decoder posts many times a second
+        if code != 200:
+            super().log_request(code, size)
+
+    def respond(self, code, body = b''):
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.respond(200, b'RH10 emulator running!')
+
+    def body_blocks(self):
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            return read_chunked(self.rfile)
+        return read_sized(self.rfile, int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        error = None
+        try:
+            if content_type in NDJSON_TYPES:
+                decoder = NDJSONDecoder()
+                for block in self.body_blocks():
+                    if error:
+                        continue
+                    try:
+                        events = decoder.feed(block)
+                    except ValueError as e:
+                        error = e
+                        continue
+                    if events:
+                        self.server.submit_events(events)
+                if not error:
+                    self.server.submit_events(decoder.finish())
+            else:
+                body = b''.join(self.body_blocks())
+                data = json.loads(body)
+                # Either a single event, or a batch of them
+                self.server.submit_events(data if isinstance(data, list) else [data])
+        except ValueError as e:
+            error = e
+        except ConnectionError as e:
+            print(f"[Emulator]: {e}")
+            self.close_connection = True
+            return
+        if error:
+            print(f"[Emulator]: Rejected malformed events: {error}")
+            self.respond(400, str(error).encode('utf-8'))
+        else:
+            self.respond(200)
+
+class EventServer(ThreadingHTTPServer):
+    # `handle_events(events)` is only ever called from the engine thread, with `lock` held.
+    # Anything else touching the state the events are applied to should hold `lock` too, and
+    # changes to it from elsewhere go through `submit` so that they're ordered with the events.
+    # `on_applied()` is called from the engine thread after every batch, without the lock.
+    daemon_threads = True
+
+    def __init__(self, handle_events, address = EMULATOR_ADDRESS, on_applied = None):
+        super().__init__(address, EventRequestHandler)
+        self.handle_events = handle_events
+        self.on_applied = on_applied
+        self.queue = queue.Queue()
+        self.lock = Lock()
+
+    def submit(self, fn, *args):
+        self.queue.put((fn, args))
+
+    def submit_events(self, events):
+        if events:
+            self.submit(self.handle_events, events)
+
+    def run_engine(self):
+        while True:
+            items = [self.queue.get()]
+            try:
+                while len(items) < ENGINE_BATCH:
+                    items.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            with self.lock:
+                for fn, args in items:
+                    try:
+                        fn(*args)
+                    except Exception as e:
+                        print(f"[Emulator]: Failed to apply events: {e!r}")
+            if self.on_applied:
+                self.on_applied()
+
+    def start(self):
+        Thread(target=self.serve_forever, daemon=True).start()
+        Thread(target=self.run_engine, daemon=True).start()
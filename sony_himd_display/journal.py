@@ -0,0 +1,278 @@
+import struct
+import codecs
+import mmap
+import json
+import os
+
+from .eventcodec import encode_event, decode_event
+from .state import State, StateHistory, apply_event
+
+# Append-only on-disk log of emulator events. The journal file is the magic, then a record per event:
+#   payload length (u32), payload (eventcodec)
+# The sidecar index (<journal>.idx) holds the file offset of every record (u64), so that any event
+# can be looked up without reading the ones before it. Both are read through mmap.
+MAGIC = b'RH10EVJ1'
+RECORD_LENGTH = struct.Struct('<I')
+INDEX_ENTRY = struct.Struct('<Q')
+
+def index_path(path):
+    return path + '.idx'
+
+def is_journal(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+class JournalReader:
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+        self.index = None
+        self.count = 0
+        self.remap()
+
+    def remap(self):
+        # Picks up whatever was appended to the files since they were last mapped
+        self.unmap()
+        size = os.path.getsize(self.path)
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not an event journal")
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        count = os.path.getsize(index_path(self.path)) // INDEX_ENTRY.size
+        if count:
+            with open(index_path(self.path), 'rb') as f:
+                self.index = mmap.mmap(f.fileno(), count * INDEX_ENTRY.size, access=mmap.ACCESS_READ)
+        # A writer which died mid-record leaves index entries without their record
+        while count and self.record_end(count - 1) > size:
+            count -= 1
+        self.count = count
+
+    def unmap(self):
+        if self.data:
+            self.data.close()
+        if self.index:
+            self.index.close()
+        self.data = self.index = None
+
+    def record_end(self, i):
+        offset = INDEX_ENTRY.unpack_from(self.index, i * INDEX_ENTRY.size)[0]
+        if offset + RECORD_LENGTH.size > len(self.data):
+            return offset + RECORD_LENGTH.size
+        return offset + RECORD_LENGTH.size + RECORD_LENGTH.unpack_from(self.data, offset)[0]
+
+    def __len__(self):
+        return self.count
+
+    def payload(self, i):
+        offset = INDEX_ENTRY.unpack_from(self.index, i * INDEX_ENTRY.size)[0]
+        length = RECORD_LENGTH.unpack_from(self.data, offset)[0]
+        offset += RECORD_LENGTH.size
+        return self.data[offset:offset + length]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return decode_event(self.payload(i))
+
+    def events(self, start = 0, end = None):
+        # Sequential read - walks the records instead of the index
+        end = len(self) if end is None else min(end, len(self))
+        if start >= end:
+            return
+        data = self.data
+        offset = INDEX_ENTRY.unpack_from(self.index, start * INDEX_ENTRY.size)[0]
+        for _ in range(end - start):
+            length = RECORD_LENGTH.unpack_from(data, offset)[0]
+            offset += RECORD_LENGTH.size
+            yield decode_event(data[offset:offset + length])
+            offset += length
+
+    def close(self):
+        self.unmap()
+
+class EventJournal(JournalReader):
+    # Appends to the journal at `path` (a new one, if it doesn't exist yet). Lookups see everything
+    # appended so far - the writes are flushed and the files remapped when they need to be.
+    def __init__(self, path, buffer_size = 1 << 16):
+        if not os.path.exists(path) or os.path.getsize(path) < len(MAGIC):
+            with open(path, 'wb') as f:
+                f.write(MAGIC)
+            open(index_path(path), 'wb').close()
+        super().__init__(path)
+        # Drop anything a crashed writer left after the last complete record
+        end = self.record_end(self.count - 1) if self.count else len(MAGIC)
+        self.unmap()
+        os.truncate(path, end)
+        os.truncate(index_path(path), self.count * INDEX_ENTRY.size)
+        self.handle = open(path, 'ab', buffering=buffer_size)
+        self.index_handle = open(index_path(path), 'ab', buffering=buffer_size)
+        self.offset = end
+        self.mapped_count = 0
+
+    def append(self, event):
+        payload = encode_event(event)
+        self.index_handle.write(INDEX_ENTRY.pack(self.offset))
+        self.handle.write(RECORD_LENGTH.pack(len(payload)))
+        self.handle.write(payload)
+        self.offset += RECORD_LENGTH.size + len(payload)
+        self.count += 1
+
+    def flush(self):
+        self.handle.flush()
+        self.index_handle.flush()
+
+    def ensure_mapped(self, end):
+        if end > self.mapped_count:
+            count = self.count
+            self.flush()
+            self.remap()
+            self.count = self.mapped_count = count
+
+    def payload(self, i):
+        self.ensure_mapped(i + 1)
+        return super().payload(i)
+
+    def events(self, start = 0, end = None):
+        self.ensure_mapped(len(self) if end is None else min(end, len(self)))
+        return super().events(start, end)
+
+    def close(self):
+        self.flush()
+        self.handle.close()
+        self.index_handle.close()
+        self.unmap()
+
+class JournalView:
+    # The part of a journal a StateHistory works on: `length` events from `start` on.
+    # Clearing it only moves the start - the journal itself is never rewritten.
+    def __init__(self, journal, start = 0, length = 0):
+        self.journal = journal
+        self.start = start
+        self.length = length
+
+    def append(self, event):
+        self.journal.append(event)
+        self.length += 1
+
+    def extend(self, count = 1):
+        # Takes in `count` more of the events already in the journal
+        self.length += count
+
+    def clear(self):
+        self.start += self.length
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        return self.journal[self.start + i]
+
+    def slice(self, start, end):
+        return list(self.journal.events(self.start + start, self.start + min(end, self.length)))
+
+def history_from_journal(reader, keyframe_interval = 256):
+    # A StateHistory over a whole journal, which keeps reading the events from it
+    view = JournalView(reader)
+    history = StateHistory(keyframe_interval, view)
+    state = State()
+    for event in reader.events():
+        state = apply_event(state, event)
+        view.extend()
+        history.track(state)
+    return history
+
+JSON_READ_SIZE = 1 << 16
+
+def iter_json_list(f, read_size = JSON_READ_SIZE):
+    # Items of the JSON list in the binary file `f`, parsed as the file is read.
+    # Yields (item, bytes of the file read so far).
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    read = 0
+    eof = False
+    started = False
+
+    def fill():
+        nonlocal buffer, pos, read, eof
+        block = f.read(read_size)
+        read += len(block)
+        eof = not block
+        buffer = buffer[pos:] + text_decoder.decode(block, eof)
+        pos = 0
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of the events file")
+            fill()
+            continue
+        char = buffer[pos]
+        if not started:
+            if char != '[':
+                raise ValueError("The events file isn't a JSON list")
+            started = True
+            pos += 1
+        elif char == ']':
+            return
+        elif char == ',':
+            pos += 1
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            if end == len(buffer) and not eof:
+                # Might have been cut short by the end of the block
+                fill()
+                continue
+            pos = end
+            yield item, read
+
+def read_event_chunks(path, chunk_size = 512):
+    # Lists of up to `chunk_size` events from either a journal, or a JSON list written by "Save Events".
+    # Yields (events, fraction of the file read so far).
+    chunk = []
+    if is_journal(path):
+        reader = JournalReader(path)
+        total = len(reader)
+        for i, event in enumerate(reader.events()):
+            chunk.append(event)
+            if len(chunk) == chunk_size:
+                yield chunk, (i + 1) / total
+                chunk = []
+        reader.close()
+    else:
+        size = os.path.getsize(path) or 1
+        read = 0
+        with open(path, 'rb') as f:
+            for event, read in iter_json_list(f):
+                chunk.append(event)
+                if len(chunk) == chunk_size:
+                    yield chunk, read / size
+                    chunk = []
+    if chunk:
+        yield chunk, 1.0
+
+def read_events(path):
+    for chunk, _ in read_event_chunks(path):
+        yield from chunk
+
+def write_json(journal, path, end = None):
+    # Streams the events into the JSON format "Save Events" used to write
+    with open(path, 'w') as f:
+        f.write('[')
+        for i, event in enumerate(journal.events(0, end)):
+            if i:
+                f.write(',')
+            f.write(json.dumps(event))
+        f.write(']')
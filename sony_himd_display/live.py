@@ -0,0 +1,189 @@
+from urllib.parse import urlparse
+import threading
+import socket
+import errno
+import sys
+import os
+
+from .core import DecoderCore, PROLOGUE_OPCODES, PROLOGUE_LENGTH, PACKET_LENGTH
+
+# Live input from the hardware clone (rh10screen/) or anything else which sends the display stream
+# as 43-byte messages - a prologue and a data packet - over a serial device, a pty or a TCP socket.
+# The messages are read straight into a ring of message slots and fed to a DecoderCore from there,
+# without copying them. The sample numbers count the bytes of the decoded messages.
+
+MESSAGE_LENGTH = PROLOGUE_LENGTH + PACKET_LENGTH
+RING_SLOTS = 300
+MESSAGE_STARTS = frozenset(PROLOGUE_OPCODES)
+
+class MessageRing:
+    # A ring of `slots` message slots. Received bytes go into the free space after the last message,
+    # complete messages are read in place. Only the incomplete tail is ever moved - back to the first
+    # slot, once the ring runs out of space.
+    def __init__(self, slots = RING_SLOTS):
+        self.buffer = bytearray(MESSAGE_LENGTH * slots)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        # Bytes skipped to find the start of a message again
+        self.skipped = 0
+
+    def free(self):
+        # Where the next bytes should be received
+        if len(self.buffer) - self.end < MESSAGE_LENGTH:
+            pending = self.end - self.start
+            self.buffer[:pending] = bytes(self.view[self.start:self.end])
+            self.start, self.end = 0, pending
+        return self.view[self.end:]
+
+    def received(self, count):
+        self.end += count
+
+    def messages(self):
+        # The complete messages received so far, as memoryviews into the ring
+        buffer, view = self.buffer, self.view
+        while self.end - self.start >= MESSAGE_LENGTH:
+            if buffer[self.start] not in MESSAGE_STARTS:
+                # Out of step - a byte got lost or added on the way
+                self.start += 1
+                self.skipped += 1
+                continue
+            message = view[self.start:self.start + MESSAGE_LENGTH]
+            self.start += MESSAGE_LENGTH
+            yield message
+
+def open_source(source, baud = None):
+    # Returns a function which receives into a writable buffer, and returns the byte count (0 at the end)
+    if source.startswith('tcp://'):
+        url = urlparse(source)
+        connection = socket.create_connection((url.hostname, url.port))
+        return connection.recv_into, connection.close
+    fd = os.open(source, os.O_RDWR | os.O_NOCTTY)
+    if os.isatty(fd):
+        import termios
+        import tty
+        # TCSANOW - flushing would drop whatever the sender got in before the port was opened
+        tty.setraw(fd, termios.TCSANOW)
+        if baud:
+            attributes = termios.tcgetattr(fd)
+            attributes[4] = attributes[5] = getattr(termios, f'B{baud}')
+            termios.tcsetattr(fd, termios.TCSANOW, attributes)
+
+    def receive(buffer):
+        try:
+            return os.readv(fd, [buffer])
+        except OSError as e:
+            # A pty whose other end was closed
+            if e.errno == errno.EIO:
+                return 0
+            raise
+    return receive, lambda: os.close(fd)
+
+class LiveDecoder:
+    # Decodes the messages from `source` (a device / pty path, or tcp://host:port) as they come in.
+    # `handle_records(records)` gets the CommandRecords, `handle_events(events)` the emulator events -
+    # both once per read, with everything decoded from it. The other arguments go to DecoderCore.
+    def __init__(self, source, handle_records = None, handle_events = None, baud = None, slots = RING_SLOTS, **kwargs):
+        self.source = source
+        self.baud = baud
+        self.handle_records = handle_records
+        self.handle_events = handle_events
+        self.ring = MessageRing(slots)
+        self.events = []
+        self.core = DecoderCore(packet_mode = True, transmit = self.events.append if handle_events else None, **kwargs)
+        self.messages = 0
+        self.failed = 0
+        self.sample = 0
+        self.stopped = False
+        self.close = None
+
+    def feed(self, message):
+        feed = self.core.feed
+        records = []
+        try:
+            for sample, value in enumerate(message, self.sample):
+                result = feed(sample, sample + 1, value)
+                if result:
+                    records += result
+        except Exception as e:
+            # Whatever the message did to the decoder, the next one starts from scratch - a unit is
+            # monitored for hours, one bad message mustn't end that
+            print(f"[Live]: Failed to decode the message at {self.sample}: {e!r}", file=sys.stderr)
+            self.failed += 1
+            self.core.reset()
+            records = []
+        self.sample += MESSAGE_LENGTH
+        self.messages += 1
+        return records
+
+    def run(self):
+        receive, self.close = open_source(self.source, self.baud)
+        ring = self.ring
+        try:
+            while not self.stopped:
+                count = receive(ring.free())
+                if not count:
+                    break
+                ring.received(count)
+                records = []
+                for message in ring.messages():
+                    records += self.feed(message)
+                if records and self.handle_records:
+                    self.handle_records(records)
+                if self.events:
+                    self.handle_events(self.events[:])
+                    self.events.clear()
+        finally:
+            self.close()
+            self.core.finish()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        # Takes effect after the next read
+        self.stopped = True
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Decode the display stream live, from the hardware clone or a pty")
+    parser.add_argument("source", help="Serial device or pty path, or tcp://host:port")
+    parser.add_argument("--baud", type=int, default=None, help="Baud rate of a serial device")
+    parser.add_argument("--emulator", default=None, help="Also send the emulator events to this address (http://localhost:36002, or shm://rh10-emulator)")
+    parser.add_argument("--quiet", action="store_true", help="Don't print the commands")
+    args = parser.parse_args()
+    sender = None
+    if args.emulator:
+        from .transport import open_sender
+        sender = open_sender(args.emulator)
+
+    def print_records(records):
+        for record in records:
+            status = '' if record.checksum_ok else ' [checksum mismatch]'
+            print(f"{record.start}-{record.end} {hex(record.opcode)}: {record.description}{status}", flush=True)
+
+    def send_events(events):
+        for event in events:
+            sender.send(event)
+
+    live = LiveDecoder(
+        args.source,
+        handle_records = None if args.quiet else print_records,
+        handle_events = send_events if sender else None,
+        baud = args.baud,
+        describe = not args.quiet,
+    )
+    if sender:
+        sender.send({"type": "init"})
+    try:
+        live.run()
+    except KeyboardInterrupt:
+        pass
+    print(f"{live.messages} messages, {live.ring.skipped} bytes skipped to resynchronize", file=sys.stderr)
+    if sender:
+        sender.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional
+from collections import deque
+import mmap
+import os
+
+from .core import (
+    DecoderCore, AnnotationType, CommandRecord, ALL_ANNOTATION_TYPES, PROLOGUE_OPCODES, PROLOGUE_LENGTH, PACKET_LENGTH,
+    cache_statistics,
+)
+from .profiling import Profiler
+
+# Batch decoding of raw captures on a process pool. The protocol is back in the IDLE state after
+# every prologue (3 bytes) and data packet (40 bytes), so a quick framing pass over the capture finds
+# packet boundaries, and the capture is cut there into chunks which decode independently. The sample
+# numbers are the byte offsets in the capture, so the merged results are the same as the ones of a
+# single DecoderCore going through the whole file.
+
+PROLOGUE_TABLE = bytes(int(x in PROLOGUE_OPCODES) for x in range(256))
+
+@dataclass
+class ChunkResult:
+    records: List[CommandRecord]
+    annotations: list
+    text_cache_hits: int
+    text_cache_misses: int
+    # End of the last complete packet
+    end: Optional[int]
+    profiler: Optional[Profiler] = None
+
+def ordered_map(fn, tasks, jobs):
+    # fn(task) for every task, in order, with at most a couple of tasks per worker in flight
+    if jobs == 1:
+        for task in tasks:
+            yield fn(task)
+        return
+    with ProcessPoolExecutor(jobs) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(fn, task))
+            if len(pending) >= jobs * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def split_points(data, chunk_size, collapse_repeats = False):
+    # Offsets of packet starts, about `chunk_size` bytes apart. With `collapse_repeats`, chunks are
+    # only split where no run of repeated packets is going on, so that a run is collapsed in one piece
+    # (and its annotation put at the same point as by a single DecoderCore).
+    points = [0]
+    size = len(data)
+    target = chunk_size
+    last_data = previous_data = None
+    i = 0
+    while i < size:
+        if PROLOGUE_TABLE[data[i]]:
+            i += PROLOGUE_LENGTH
+            continue
+        if i >= target and not (collapse_repeats and last_data is not None and (
+            data[i:i + PACKET_LENGTH] == data[last_data:last_data + PACKET_LENGTH] or
+            previous_data is not None and
+            data[last_data:last_data + PACKET_LENGTH] == data[previous_data:previous_data + PACKET_LENGTH]
+        )):
+            points.append(i)
+            target = i + chunk_size
+        previous_data, last_data = last_data, i
+        i += PACKET_LENGTH
+    return points
+
+def decode_chunk(task):
+    path, start, end, options, profile = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    annotations = []
+    profiler = Profiler() if profile else None
+    annotate = (lambda *x: annotations.append(x)) if options.get("annotation_types") else None
+    core = DecoderCore(annotate = annotate, profiler = profiler, **options)
+    records = []
+    feed = core.feed
+    for i, value in enumerate(data, start):
+        result = feed(i, i + 1, value)
+        if result:
+            records += result
+    # Only the last chunk can end in a run of repeats
+    core.put_repeats()
+    return ChunkResult(records, annotations, core.text_cache.hits, core.text_cache.misses, core.start_of_current_state, profiler)
+
+class ParallelDecoder:
+    # Decodes capture files like decode_file(), on `jobs` processes (one per CPU by default).
+    # `annotate` gets the annotations in order, as they would have come from a single DecoderCore -
+    # except for the statistics, which cover the whole capture and are put by finish(). There are no
+    # SCREEN annotations, every chunk would start with a blank screen.
+    # The other arguments are DecoderCore's - descriptor files need the commands in order, and
+    # aren't supported.
+    def __init__(self, annotate = None, jobs = None, chunk_size = 1 << 20, packet_mode = True, annotation_types = ALL_ANNOTATION_TYPES, collapse_repeats = False, describe = False, profiler = None):
+        self.annotate = annotate
+        self.jobs = jobs or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.collapse_repeats = collapse_repeats
+        self.profiler = profiler
+        annotation_types = set(annotation_types) if annotate else set()
+        self.stats_enabled = AnnotationType.STATS in annotation_types
+        self.options = {
+            "packet_mode": packet_mode,
+            "annotation_types": tuple(annotation_types - {AnnotationType.STATS, AnnotationType.SCREEN}),
+            "collapse_repeats": collapse_repeats,
+            "describe": describe,
+        }
+        self.text_cache_hits = self.text_cache_misses = 0
+        self.first_sample = self.last_sample = None
+
+    def tasks(self, path):
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                points = split_points(data, self.chunk_size, self.collapse_repeats)
+                size = len(data)
+        for start, end in zip(points, points[1:] + [size]):
+            yield (path, start, end, self.options, self.profiler is not None)
+
+    def decode_file(self, path):
+        for result in ordered_map(decode_chunk, self.tasks(path), self.jobs):
+            if self.first_sample is None:
+                self.first_sample = 0
+            if result.end is not None:
+                self.last_sample = result.end
+            if self.annotate:
+                for annotation in result.annotations:
+                    self.annotate(*annotation)
+            self.text_cache_hits += result.text_cache_hits
+            self.text_cache_misses += result.text_cache_misses
+            if self.profiler:
+                self.profiler.merge(result.profiler)
+            yield from result.records
+        self.finish()
+
+    def statistics(self):
+        stats = [cache_statistics(self.text_cache_hits, self.text_cache_misses)]
+        if self.profiler:
+            stats.append(self.profiler.summary())
+        return stats
+
+    def finish(self):
+        if self.annotate and self.stats_enabled and self.first_sample is not None:
+            for texts in self.statistics():
+                self.annotate(self.first_sample, self.last_sample, AnnotationType.STATS, [*texts])
+
+def decode_file_parallel(path, **kwargs):
+    yield from ParallelDecoder(**kwargs).decode_file(path)
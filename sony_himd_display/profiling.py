@@ -0,0 +1,84 @@
+from dataclasses import dataclass, asdict
+import time
+import json
+
+@dataclass
+class OpcodeStats:
+    calls: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+    bytes: int = 0
+
+class Profiler:
+    # Counters for DecoderCore - handler time includes the time spent transmitting the handler's events.
+    def __init__(self):
+        self.opcodes = {}
+        self.packets = 0
+        self.checksum_failures = 0
+        self.transmit_calls = 0
+        self.transmit_time = 0.0
+
+    def run_command(self, handler, core, data):
+        start = time.perf_counter()
+        handler(core, data)
+        elapsed = time.perf_counter() - start
+        stats = self.opcodes.get(data[0])
+        if stats is None:
+            stats = self.opcodes[data[0]] = OpcodeStats()
+        stats.calls += 1
+        stats.total_time += elapsed
+        stats.bytes += len(data)
+        if elapsed > stats.max_time:
+            stats.max_time = elapsed
+
+    def transmit(self, transmit_to_emulator, data):
+        start = time.perf_counter()
+        transmit_to_emulator(data)
+        self.transmit_time += time.perf_counter() - start
+        self.transmit_calls += 1
+
+    def packet(self, checksum_ok):
+        self.packets += 1
+        if not checksum_ok:
+            self.checksum_failures += 1
+
+    def merge(self, other):
+        # Adds the counters of another Profiler (from a worker process) to these
+        for opcode, theirs in other.opcodes.items():
+            stats = self.opcodes.get(opcode)
+            if stats is None:
+                stats = self.opcodes[opcode] = OpcodeStats()
+            stats.calls += theirs.calls
+            stats.total_time += theirs.total_time
+            stats.bytes += theirs.bytes
+            stats.max_time = max(stats.max_time, theirs.max_time)
+        self.packets += other.packets
+        self.checksum_failures += other.checksum_failures
+        self.transmit_calls += other.transmit_calls
+        self.transmit_time += other.transmit_time
+
+    def by_total_time(self):
+        return sorted(self.opcodes.items(), key=lambda x: x[1].total_time, reverse=True)
+
+    def summary(self, top = 5):
+        busiest = ', '.join(
+            f"{hex(opcode)}: {stats.calls}x {stats.total_time * 1000:.1f}ms (max {stats.max_time * 1e6:.0f}us)"
+            for opcode, stats in self.by_total_time()[:top]
+        )
+        return (
+            f"Profile: {self.packets} packets, {self.checksum_failures} checksum failures, "
+            f"emulator {self.transmit_calls}x {self.transmit_time * 1000:.1f}ms; busiest handlers - {busiest}",
+            f"Profile: {self.checksum_failures} bad checksums, top {hex(self.by_total_time()[0][0]) if self.opcodes else '-'}",
+        )
+
+    def to_dict(self):
+        return {
+            "packets": self.packets,
+            "checksum_failures": self.checksum_failures,
+            "transmit": {"calls": self.transmit_calls, "total_time": self.transmit_time},
+            "opcodes": dict((f"0x{opcode:02x}", asdict(stats)) for opcode, stats in self.by_total_time()),
+        }
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
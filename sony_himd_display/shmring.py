@@ -0,0 +1,192 @@
+from multiprocessing import shared_memory
+import threading
+import struct
+import time
+import os
+
+from .eventcodec import encode_event, decode_event
+
+# Emulator events over shared memory, for a decoder and an emulator on the same host - no sockets,
+# no JSON. The emulator creates the segment, the decoder attaches to it. The segment is a header:
+#   magic, data capacity (u32), pid of the emulator (u32), write position (u64), read position (u64)
+# and a ring of records: payload length (u32), payload (eventcodec). The positions only ever grow,
+# the offset in the ring is position % capacity. A record never wraps around the end of the ring -
+# when it doesn't fit, the rest of the ring is skipped (marked with a PAD length, if there's room).
+# One writer and one reader: the writer only moves the write position, the reader the read one.
+
+MAGIC = b'RH10SHM1'
+HEADER = struct.Struct('<8sII')
+POSITION = struct.Struct('<Q')
+WRITE_POSITION = HEADER.size
+READ_POSITION = WRITE_POSITION + POSITION.size
+DATA_OFFSET = READ_POSITION + POSITION.size
+LENGTH = struct.Struct('<I')
+PAD = 0xFFFFFFFF
+
+DEFAULT_NAME = 'rh10-emulator'
+DEFAULT_CAPACITY = 1 << 20
+
+def attach(name):
+    # Without registering the segment with this process' resource tracker, which would unlink it
+    # when the process exits - it's the emulator's
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        from multiprocessing import resource_tracker
+        segment = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(segment._name, 'shared_memory')
+        return segment
+
+def process_exists(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def owner(name):
+    # pid of the running emulator which created the segment, or None if it's gone (or the segment
+    # isn't an event ring at all)
+    segment = attach(name)
+    try:
+        if segment.size < HEADER.size:
+            return None
+        magic, _, pid = HEADER.unpack_from(segment.buf)
+    finally:
+        segment.close()
+    if magic != MAGIC or not process_exists(pid):
+        return None
+    return pid
+
+class ShmSender:
+    # The decoder's end - the same interface as transport.EmulatorSender. Raises FileNotFoundError
+    # if there's no emulator which created the segment.
+    def __init__(self, name = DEFAULT_NAME, max_wait = 0.5):
+        self.segment = attach(name)
+        self.buffer = self.segment.buf
+        magic, self.capacity, _ = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            self.segment.close()
+            raise ValueError(f"Shared memory segment {name} isn't an event ring")
+        self.max_wait = max_wait
+        self.write = POSITION.unpack_from(self.buffer, WRITE_POSITION)[0]
+        self.sent = 0
+        self.waits = 0
+        self.dropped = 0
+
+    def space(self):
+        return self.capacity - (self.write - POSITION.unpack_from(self.buffer, READ_POSITION)[0])
+
+    def send(self, event):
+        payload = encode_event(event)
+        offset = self.write % self.capacity
+        skip = 0
+        if self.capacity - offset < LENGTH.size + len(payload):
+            skip = self.capacity - offset
+        needed = skip + LENGTH.size + len(payload)
+        if needed > self.space():
+            # Back-pressure, like EmulatorSender - wait for the emulator for a while, then drop
+            self.waits += 1
+            deadline = time.monotonic() + self.max_wait
+            while needed > self.space():
+                if time.monotonic() > deadline:
+                    self.dropped += 1
+                    return
+                time.sleep(0.001)
+        buffer = self.buffer
+        if skip:
+            if skip >= LENGTH.size:
+                LENGTH.pack_into(buffer, DATA_OFFSET + offset, PAD)
+            self.write += skip
+            offset = 0
+        LENGTH.pack_into(buffer, DATA_OFFSET + offset, len(payload))
+        start = DATA_OFFSET + offset + LENGTH.size
+        buffer[start:start + len(payload)] = payload
+        self.write += LENGTH.size + len(payload)
+        # Published only once the record is complete
+        POSITION.pack_into(buffer, WRITE_POSITION, self.write)
+        self.sent += 1
+
+    def pending(self):
+        # Bytes the emulator hasn't read yet
+        return self.capacity - self.space()
+
+    def close(self, timeout = 5):
+        self.buffer = None
+        self.segment.close()
+
+class ShmReceiver:
+    # The emulator's end - creates the segment (replacing one left behind by a crashed emulator),
+    # and calls `handle_events(events)` from a thread with whatever has been written since the last call.
+    # Raises FileExistsError if another emulator is using the segment.
+    def __init__(self, handle_events, name = DEFAULT_NAME, capacity = DEFAULT_CAPACITY, max_sleep = 0.001):
+        try:
+            self.segment = shared_memory.SharedMemory(name, create=True, size=DATA_OFFSET + capacity)
+        except FileExistsError:
+            pid = owner(name)
+            if pid is not None:
+                raise FileExistsError(f"Shared memory segment {name} is used by the emulator with pid {pid}")
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.segment = shared_memory.SharedMemory(name, create=True, size=DATA_OFFSET + capacity)
+        self.buffer = self.segment.buf
+        self.capacity = capacity
+        HEADER.pack_into(self.buffer, 0, MAGIC, capacity, os.getpid())
+        POSITION.pack_into(self.buffer, WRITE_POSITION, 0)
+        POSITION.pack_into(self.buffer, READ_POSITION, 0)
+        self.read = 0
+        self.handle_events = handle_events
+        self.max_sleep = max_sleep
+        self.stopped = False
+        self.thread = None
+
+    def receive(self):
+        buffer, capacity = self.buffer, self.capacity
+        write = POSITION.unpack_from(buffer, WRITE_POSITION)[0]
+        events = []
+        read = self.read
+        while read < write:
+            offset = read % capacity
+            if capacity - offset < LENGTH.size:
+                read += capacity - offset
+                continue
+            length = LENGTH.unpack_from(buffer, DATA_OFFSET + offset)[0]
+            if length == PAD:
+                read += capacity - offset
+                continue
+            start = DATA_OFFSET + offset + LENGTH.size
+            events.append(decode_event(buffer[start:start + length]))
+            read += LENGTH.size + length
+        if read != self.read:
+            self.read = read
+            POSITION.pack_into(buffer, READ_POSITION, read)
+        return events
+
+    def run(self):
+        # Polls - right away while events are coming in, backing off to `max_sleep` when idle
+        sleep = 0
+        while not self.stopped:
+            events = self.receive()
+            if events:
+                self.handle_events(events)
+                sleep = 0
+            else:
+                time.sleep(sleep)
+                sleep = min(sleep * 2 or 0.0001, self.max_sleep)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopped = True
+        if self.thread:
+            self.thread.join()
+        self.buffer = None
+        self.segment.close()
+        self.segment.unlink()
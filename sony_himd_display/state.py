@@ -0,0 +1,193 @@
+from dataclasses import dataclass, field
+from typing import List
+import pickle
+import json
+
+@dataclass
+class Row:
+    data: List[str] = field(default_factory=lambda: [''] * 20)
+    inverted: bool = False
+    start: int = 0x00
+    end: int = 0x19
+
+def create_screen_matrix():
+    a = []
+    for _ in range(6):
+        a.append(Row())
+    return a
+
+@dataclass
+class ScrollBar:
+    enabled: bool = False
+    from_px: int = 0
+    to_px: int = 0
+
+@dataclass
+class TrackBar:
+    enabled: bool = False
+    from_px: int = 0
+    to_px: int = 0
+    row: int = 0
+
+@dataclass
+class Battery:
+    outline: bool
+    enabled: bool
+    charging: bool
+    segments: int
+
+@dataclass
+class State:
+    screen_matrix: List[Row] = field(default_factory=create_screen_matrix)
+    message: str = "<unset>"
+    scroll_bar_state: ScrollBar = field(default_factory=ScrollBar)
+    track_bar_state: TrackBar = field(default_factory=TrackBar)
+    bar_enabled: bool = False
+    groups_icon_enabled: bool = False
+    is_hi_enabled: bool = False
+    is_md_enabled: bool = False
+    battery: Battery = field(default_factory=lambda: Battery(False, False, False, 0))
+    play_modes: List[str] = field(default_factory=list)
+    current_playback_glyph: str = ""
+
+def apply_event(current_state, event):
+    # Applies the event to current_state in place, and returns the state to carry on with
+    # ("init" and "reset" start from a blank one).
+    current_state.message = "Unset"
+    _type = event["type"]
+    if _type == "display":
+        row, col, data, clear_remain = event["row"], event["col"], event["data"], event["clearRemaining"]
+        start = current_state.screen_matrix[row].start
+        data = data[:current_state.screen_matrix[row].end - start]
+        if clear_remain:
+            # E0, E3
+            current_state.screen_matrix[row].data[col+start:] = data
+        else:
+            current_state.screen_matrix[row].data[col+start:col+len(data)] = data
+        current_state.message = f"Set {row=} to {data}"
+    if _type == "clear":
+        # HACK: Not sure if this is meant to work like this, or if there's a separate command to clear
+        # the track progress bar.
+        if current_state.track_bar_state.row in event['rows']:
+            current_state.track_bar_state.enabled = False
+        for row in event["rows"]:
+            current_state.screen_matrix[row].data = [''] * 20
+            current_state.screen_matrix[row].start = 0
+            current_state.screen_matrix[row].end = 0x19
+        current_state.message = f"Clear rows: {', '.join(str(x) for x in event['rows'])}"
+    if _type == "init":
+        current_state = State()
+        current_state.message = "init"
+    if _type == "reset":
+        current_state = State()
+        current_state.message = "Reset"
+    if _type == "invert":
+        rows = event["rows"]
+        current_state.message = f'Invert rows: {rows}'
+        #for row in range(6):
+            #if row in rows:
+                #current_state.screen_matrix[row].inverted = not current_state.screen_matrix[row].inverted
+            #else:
+                #current_state.screen_matrix[row].inverted = False
+        for row in range(6):
+            current_state.screen_matrix[row].inverted = row in rows
+    if _type == "scrollbar":
+        current_state.scroll_bar_state.from_px = event['from']
+        current_state.scroll_bar_state.to_px = event['to']
+        current_state.scroll_bar_state.enabled = event['enabled']
+        current_state.message = f'Update scroll bar {current_state.scroll_bar_state.from_px} => {current_state.scroll_bar_state.to_px}, enabled = {current_state.scroll_bar_state.enabled}'
+    if _type == "trackbar":
+        current_state.track_bar_state.enabled = event['enabled']
+        current_state.track_bar_state.to_px = event['to']
+        current_state.track_bar_state.from_px = event['from']
+        current_state.track_bar_state.row = event['rows']
+        current_state.message = f'Update track bar {current_state.track_bar_state.from_px} => {current_state.track_bar_state.to_px}, enabled = {current_state.track_bar_state.enabled}'
+    if _type == "bar":
+        current_state.bar_enabled = event['enabled']
+    if _type == "format":
+        current_state.is_hi_enabled = event['hi']
+        current_state.is_md_enabled = event['md']
+    if _type == "groups":
+        current_state.groups_icon_enabled = event['enabled']
+    if _type == "glyph":
+        current_state.current_playback_glyph = event['glyph']
+    if _type == "playmode":
+        current_state.play_modes = event['entries']
+    if _type == "limit":
+        for row in event['rows']:
+            current_state.screen_matrix[row].start = event['start']
+            current_state.screen_matrix[row].end = event['end']
+    return current_state
+
+def row_text(row):
+    # The special characters are named, like decode_text() does
+    return ''.join(x if len(x) == 1 else f'<{x}>' if x else ' ' for x in row.data).rstrip()
+
+class EventList:
+    # The default event store of a StateHistory - compact JSON, in memory
+    def __init__(self):
+        self.items = []
+
+    def append(self, event):
+        self.items.append(json.dumps(event, separators=(',', ':')))
+
+    def clear(self):
+        self.items = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        return json.loads(self.items[i])
+
+    def slice(self, start, end):
+        return [json.loads(x) for x in self.items[start:end]]
+
+class StateHistory:
+    # The state after every event, without keeping every state around: a pickled copy is taken
+    # every `keyframe_interval` events, and the events in between are replayed on top of the
+    # closest keyframe when a state is looked up.
+    # `events` stores the events - an EventList by default, or a journal.JournalView to keep them on disk.
+    def __init__(self, keyframe_interval = 256, events = None):
+        self.keyframe_interval = keyframe_interval
+        self.events = EventList() if events is None else events
+        self.reset_keyframes()
+
+    def reset_keyframes(self):
+        self.keyframes = []
+        self.cursor_index = None
+        self.cursor_state = None
+
+    def clear(self):
+        self.events.clear()
+        self.reset_keyframes()
+
+    def __len__(self):
+        return len(self.events)
+
+    def append(self, event, resulting_state):
+        # `resulting_state` is the live state right after `event` has been applied to it.
+        self.events.append(event)
+        self.track(resulting_state)
+
+    def track(self, resulting_state):
+        # Like append(), for an event which was added to the store directly
+        if (len(self.events) - 1) % self.keyframe_interval == 0:
+            self.keyframes.append(pickle.dumps(resulting_state, pickle.HIGHEST_PROTOCOL))
+
+    def __getitem__(self, index):
+        # The returned state is shared with the history - it is only valid until the next lookup,
+        # and must not be modified.
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        keyframe = index // self.keyframe_interval
+        if self.cursor_index is None or not (keyframe * self.keyframe_interval <= self.cursor_index <= index):
+            # Can't walk forwards from the last lookup, start over from the keyframe
+            self.cursor_index = keyframe * self.keyframe_interval
+            self.cursor_state = pickle.loads(self.keyframes[keyframe])
+        while self.cursor_index < index:
+            self.cursor_index += 1
+            self.cursor_state = apply_event(self.cursor_state, self.events[self.cursor_index])
+        return self.cursor_state
@@ -0,0 +1,188 @@
+from functools import reduce
+import operator
+import random
+
+from .core import PACKET_LENGTH, PROLOGUE_LENGTH, ENCODING_MAP
+
+# Synthetic display traffic in the format core.DecoderCore understands - for benchmarks, and for
+# exercising the decoder without a capture of a real unit.
+
+PROLOGUES = (0x3D, 0x3F, 0xFF)
+PAYLOAD_LENGTH = PACKET_LENGTH - 1
+ENCODINGS = dict((name, code) for code, name in ENCODING_MAP.items())
+
+LATIN1_TITLES = [
+    "Track 01", "Track 02", "Blue Monday", "Teardrop", "Windowlicker", "Rhubarb",
+    "Avril 14th", "Xtal", "Roygbiv", "Music Is Math", "Hi-MD Walkman", "Group 03",
+]
+SJIS_TITLES = ["ミニディスク", "音楽", "東京", "夜明け", "トラック"]
+UTF16_TITLES = ["Café", "Ümlaut", "Øresund", "Ça va"]
+# (namespace byte, character byte) - big digits, the ':' and the icons
+BIG_DIGITS = [(0xFD, 0x65 + x) for x in range(10)]
+BIG_COLON = (0xFA, 0x55)
+ICONS = [(0xFD, 0x70), (0xFD, 0x86), (0xFD, 0x93), (0xFD, 0x6f)]
+
+def row_bit(row):
+    return 1 << row
+
+def rows_bitfield(rows):
+    return reduce(operator.or_, (row_bit(x) for x in rows), 0)
+
+def text_command(row, text_bytes, encoding, status_only = False):
+    # E0 / E3
+    return bytes([0xE3 if status_only else 0xE0, row_bit(row), len(text_bytes), ENCODINGS[encoding]]) + text_bytes
+
+def special_text_command(row, text_bytes, encoding, what = 0):
+    # E2
+    return bytes([0xE2, row_bit(row), what, len(text_bytes), ENCODINGS[encoding]]) + text_bytes
+
+def heartbeat():
+    return bytes([0x02, 0x81])
+
+def clear_rows(rows):
+    return bytes([0x03, rows_bitfield(rows)])
+
+def invert_rows(rows):
+    # The bitfield holds the rows which are *not* inverted
+    return bytes([0x05, ~rows_bitfield(rows) & 0x3F])
+
+def limit_rows(rows, start, end):
+    return bytes([0x53, rows_bitfield(rows), start, end, 0])
+
+def scrollbar(from_px, to_px, enabled = True):
+    return bytes([0x68, from_px, to_px, 0, 1 if enabled else 0])
+
+def trackbar(row, from_px, to_px, enabled = True):
+    return bytes([0x69, row_bit(row), from_px, to_px, 1 if enabled else 0])
+
+def top_bar(enabled):
+    return bytes([0x23, 1 if enabled else 0])
+
+def play_glyph(glyph):
+    return bytes([0x1B, glyph])
+
+def prologue(opcode = 0x3D):
+    return bytes([opcode] + [0] * (PROLOGUE_LENGTH - 1))
+
+def packet(commands, corrupt = False):
+    body = b''.join(commands)
+    if len(body) > PAYLOAD_LENGTH:
+        raise ValueError(f"{len(body)} bytes of commands don't fit in a packet")
+    body = body.ljust(PAYLOAD_LENGTH, b'\0')
+    checksum = reduce(operator.xor, body, 0) ^ 0xFF
+    if corrupt:
+        checksum ^= 1
+    return body + bytes([checksum])
+
+def pack_commands(commands):
+    # Greedily fills packets with the commands, in order
+    packets = []
+    current = []
+    length = 0
+    for command in commands:
+        if length + len(command) > PAYLOAD_LENGTH:
+            packets.append(current)
+            current, length = [], 0
+        current.append(command)
+        length += len(command)
+    if current:
+        packets.append(current)
+    return packets
+
+class SessionGenerator:
+    # A made-up, but plausible session: menus of titles, a clock drawn with the big digits, scrolling,
+    # track progress, and lots of heartbeat packets while nothing changes.
+    def __init__(self, seed = 0, corrupt_rate = 0.0):
+        self.random = random.Random(seed)
+        self.corrupt_rate = corrupt_rate
+        self.seconds = 0
+
+    def random_text(self, row):
+        r = self.random.random()
+        if r < 0.6:
+            title = self.random.choice(LATIN1_TITLES)
+            return text_command(row, title.encode('latin1'), 'latin1', self.random.random() < 0.2)
+        if r < 0.8:
+            title = self.random.choice(SJIS_TITLES)
+            prefix = bytes(self.random.choice(ICONS)) if self.random.random() < 0.5 else b''
+            return text_command(row, prefix + title.encode('sjis'), 'sjis')
+        title = self.random.choice(UTF16_TITLES)
+        return text_command(row, title.encode('utf-16-be'), 'utf-16-be')
+
+    def clock(self, row):
+        minutes, seconds = divmod(self.seconds, 60)
+        digits = b''.join(bytes(BIG_DIGITS[int(x)]) for x in f"{minutes % 100:02}")
+        digits += bytes(BIG_COLON)
+        digits += b''.join(bytes(BIG_DIGITS[int(x)]) for x in f"{seconds:02}")
+        return special_text_command(row, digits, 'sjis')
+
+    def screen(self):
+        rows = list(range(6))
+        commands = [clear_rows(rows), top_bar(True), limit_rows([1], 2, 18)]
+        commands += [self.random_text(row) for row in rows[:-1]]
+        commands.append(self.clock(5))
+        selected = self.random.randrange(6)
+        commands.append(invert_rows([selected]))
+        commands.append(scrollbar(selected * 10, selected * 10 + 12))
+        return commands
+
+    def step(self):
+        r = self.random.random()
+        if r < 0.5:
+            return [heartbeat()]
+        if r < 0.65:
+            self.seconds += 1
+            progress = min(self.seconds % 300 // 5, 63)
+            return [self.clock(5), trackbar(4, 1, progress + 1)]
+        if r < 0.8:
+            row = self.random.randrange(6)
+            return [self.random_text(row), invert_rows([row]), scrollbar(row * 10, row * 10 + 12)]
+        if r < 0.95:
+            return [play_glyph(self.random.randrange(8)), heartbeat()]
+        return self.screen()
+
+    def packets(self, count):
+        # Yields the raw bytes of `count` data packets, each preceded by a prologue
+        produced = 0
+        queued = []
+        while produced < count:
+            if not queued:
+                queued = pack_commands(self.step())
+            commands = queued.pop(0)
+            yield prologue(self.random.choice(PROLOGUES))
+            yield packet(commands, self.random.random() < self.corrupt_rate)
+            produced += 1
+
+    def capture(self, count):
+        return b''.join(self.packets(count))
+
+def iter_samples(data, samples_per_byte = 16, gap = 400):
+    # (start, end, byte) tuples the way the SPI decoder would produce them - with a gap between messages.
+    sample = 0
+    in_message = 0
+    i = 0
+    length = len(data)
+    while i < length:
+        b = data[i]
+        if not in_message:
+            in_message = PROLOGUE_LENGTH if b in PROLOGUES else PACKET_LENGTH
+            sample += gap
+        yield (sample, sample + samples_per_byte, b)
+        sample += samples_per_byte
+        in_message -= 1
+        i += 1
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate a synthetic RH10/RH910 display SPI capture")
+    parser.add_argument("output", help="Where to write the raw MOSI bytes")
+    parser.add_argument("--packets", type=int, default=10000, help="Number of data packets")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corrupt-rate", type=float, default=0.0, help="Fraction of packets with a bad checksum")
+    args = parser.parse_args()
+    with open(args.output, 'wb') as f:
+        for chunk in SessionGenerator(args.seed, args.corrupt_rate).packets(args.packets):
+            f.write(chunk)
+
+if __name__ == "__main__":
+    main()
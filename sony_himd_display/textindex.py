@@ -0,0 +1,199 @@
+from dataclasses import dataclass
+import sqlite3
+import sys
+import os
+
+# SQLite index of the texts written to the display, for finding when something was shown without
+# decoding the capture again. Every distinct text is stored once; an occurrence is a text written by
+# one opcode to one row, over the sample range it was shown. Writing the same text to the same row
+# again extends the current occurrence instead of adding one, so a title redrawn for an hour is a
+# single range. A clear of the row, or any other write to it, ends the occurrence - a row holds the
+# text of its last write.
+
+SUFFIX = '.textidx'
+CLEAR_ROWS_OPCODE = 0x03
+ROW_COUNT = 6
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS texts (id INTEGER PRIMARY KEY, text TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS occurrences (
+    text_id INTEGER NOT NULL REFERENCES texts(id),
+    opcode INTEGER NOT NULL,
+    row INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    writes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS occurrences_text ON occurrences (text_id, start);
+CREATE INDEX IF NOT EXISTS occurrences_start ON occurrences (start);
+'''
+
+@dataclass
+class Occurrence:
+    text: str
+    opcode: int
+    row: int
+    # From the start of the first write to the start of the command which replaced or cleared it - or
+    # to the end of the last command of the capture, if nothing did
+    start: int
+    end: int
+    writes: int
+
+def index_path(capture_path):
+    return capture_path + SUFFIX
+
+class TextIndex:
+    def __init__(self, path, batch_size = 1024):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.batch_size = batch_size
+        self.text_ids = {}
+        # row => [text, opcode, start, end, writes] of the occurrence still being shown
+        self.open = {}
+        self.pending = []
+        self.last_end = 0
+
+    def clear(self):
+        self.db.executescript('DELETE FROM occurrences; DELETE FROM texts;')
+        self.text_ids = {}
+        self.open = {}
+        self.pending = []
+        self.last_end = 0
+
+    def text_id(self, text):
+        text_id = self.text_ids.get(text)
+        if text_id is None:
+            self.db.execute('INSERT OR IGNORE INTO texts (text) VALUES (?)', (text,))
+            text_id = self.text_ids[text] = self.db.execute('SELECT id FROM texts WHERE text = ?', (text,)).fetchone()[0]
+        return text_id
+
+    def add(self, text, opcode, row, start, end):
+        current = self.open.get(row)
+        if current and current[0] == text and current[1] == opcode:
+            current[3] = end
+            current[4] += 1
+            return
+        self.close_row(row, start)
+        self.open[row] = [text, opcode, start, end, 1]
+
+    def close_row(self, row, end):
+        current = self.open.pop(row, None)
+        if current:
+            current[3] = end
+            self.store(row, current)
+
+    def clear_rows(self, rows, start):
+        # `rows` is the bitfield of the clear command
+        for row in range(ROW_COUNT):
+            if rows & (1 << row):
+                self.close_row(row, start)
+
+    def add_record(self, record):
+        # Takes all the DecoderCore records - the text and clear commands are indexed, the rest only
+        # tell how long the capture goes on
+        self.last_end = max(self.last_end, record.end)
+        if record.opcode == CLEAR_ROWS_OPCODE:
+            self.clear_rows(record.fields['rows'], record.start)
+            return
+        text = record.fields.get('text')
+        if text is not None:
+            self.add(text, record.opcode, record.fields['row'], record.start, record.end)
+
+    def store(self, row, occurrence):
+        text, opcode, start, end, writes = occurrence
+        self.pending.append((self.text_id(text), opcode, row, start, end, writes))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.db.executemany('INSERT INTO occurrences VALUES (?, ?, ?, ?, ?, ?)', self.pending)
+        self.db.commit()
+        self.pending = []
+
+    def finish(self):
+        for row, occurrence in self.open.items():
+            occurrence[3] = max(occurrence[3], self.last_end)
+            self.store(row, occurrence)
+        self.open = {}
+        self.flush()
+
+    def find(self, text, exact = False, opcode = None, row = None, limit = None):
+        # Occurrences of the texts containing `text` (or equal to it), in sample order
+        query = '''
+            SELECT texts.text, opcode, row, start, end, writes FROM occurrences
+            JOIN texts ON texts.id = occurrences.text_id
+            WHERE text_id IN (SELECT id FROM texts WHERE {})
+        '''.format('text = ?' if exact else "instr(text, ?) > 0")
+        args = [text]
+        if opcode is not None:
+            query += ' AND opcode = ?'
+            args.append(opcode)
+        if row is not None:
+            query += ' AND row = ?'
+            args.append(row)
+        query += ' ORDER BY start'
+        if limit is not None:
+            query += ' LIMIT ?'
+            args.append(limit)
+        return [Occurrence(*x) for x in self.db.execute(query, args)]
+
+    def at(self, sample):
+        # What was on the rows at `sample` - the occurrences whose range covers it
+        return [Occurrence(*x) for x in self.db.execute('''
+            SELECT texts.text, opcode, row, start, end, writes FROM occurrences
+            JOIN texts ON texts.id = occurrences.text_id
+            WHERE start <= ? AND end > ? ORDER BY row
+        ''', (sample, sample))]
+
+    def texts(self):
+        return [x[0] for x in self.db.execute('SELECT text FROM texts ORDER BY text')]
+
+    def close(self):
+        if self.open or self.pending:
+            self.finish()
+        self.db.close()
+
+def build_index(capture, path = None, **kwargs):
+    # Decodes a raw capture into a fresh index next to it. kwargs go to decode_file().
+    from .core import decode_file
+    index = TextIndex(path or index_path(capture))
+    index.clear()
+    for record in decode_file(capture, packet_mode = True, **kwargs):
+        index.add_record(record)
+    index.finish()
+    return index
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Find when a text was shown on the display")
+    parser.add_argument("capture", help="Raw capture (its index is <capture>" + SUFFIX + "), or the index itself")
+    parser.add_argument("text", nargs='?', default=None, help="Text to look for - all the indexed texts are listed without it")
+    parser.add_argument("--exact", action="store_true", help="Only texts equal to TEXT, not the ones containing it")
+    parser.add_argument("--opcode", type=lambda x: int(x, 0), default=None, help="Only the texts written by this opcode")
+    parser.add_argument("--row", type=int, default=None, help="Only the texts written to this row")
+    parser.add_argument("--at", type=int, default=None, help="Show the texts on the rows at this sample instead")
+    parser.add_argument("--limit", type=int, default=None, help="Print at most this many occurrences")
+    parser.add_argument("--rebuild", action="store_true", help="Decode the capture again, even if it already has an index")
+    args = parser.parse_args()
+    if args.capture.endswith(SUFFIX):
+        index = TextIndex(args.capture)
+    elif args.rebuild or not os.path.exists(index_path(args.capture)):
+        print(f"Indexing {args.capture}...", file=sys.stderr)
+        index = build_index(args.capture)
+    else:
+        index = TextIndex(index_path(args.capture))
+    if args.at is not None:
+        occurrences = index.at(args.at)
+    elif args.text is None:
+        for text in index.texts():
+            print(text)
+        index.close()
+        return
+    else:
+        occurrences = index.find(args.text, args.exact, args.opcode, args.row, args.limit)
+    for x in occurrences:
+        print(f"{x.start}-{x.end} {hex(x.opcode)} row {x.row}: '{x.text}'" + (f" (x{x.writes})" if x.writes > 1 else ''))
+    index.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+from threading import Thread
+import queue
+import time
+import json
+
+import requests
+
+EMULATOR_URL = "http://localhost:36002"
+
+class EmulatorSender:
+    # Ships emulator events from a worker thread, so decoding never waits for an HTTP round-trip.
+    # Events are posted as NDJSON (one event per line), flushed once `batch_size` events are waiting, or
+    # `batch_interval` seconds after the first one of a batch came in. A post which gets no answer
+    # within `request_timeout` seconds fails.
+    def __init__(self, address, queue_length = 4096, batch_size = 256, batch_interval = 0.05, max_wait = 0.5, request_timeout = 2):
+        self.address = address
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_wait = max_wait
+        self.request_timeout = request_timeout
+        self.queue = queue.Queue(queue_length)
+        # Whether the last batch got through
+        self.healthy = True
+
+        self.sent = 0
+        self.batches = 0
+        self.waits = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Back-pressure - hold the decoder for a while, but don't let a dead emulator stall it.
+            if not self.healthy:
+                self.dropped += 1
+                return
+            self.waits += 1
+            try:
+                self.queue.put(event, timeout=self.max_wait)
+            except queue.Full:
+                self.dropped += 1
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def collect_batch(self):
+        event = self.queue.get()
+        if event is None:
+            return None, True
+        batch = [event]
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                event = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if event is None:
+                return batch, True
+            batch.append(event)
+        return batch, False
+
+    def run(self):
+        # The session keeps the connection to the emulator alive between batches.
+        session = requests.Session()
+        finished = False
+        while not finished:
+            batch, finished = self.collect_batch()
+            if not batch:
+                continue
+            try:
+                body = ''.join(json.dumps(event, separators=(',', ':')) + '\n' for event in batch)
+                session.post(self.address, data=body.encode('utf-8'), headers={'Content-Type': 'application/x-ndjson'}, timeout=self.request_timeout)
+                self.sent += len(batch)
+                self.healthy = True
+            except requests.RequestException as e:
+                print(f"[Emulator]: Failed to transmit {len(batch)} events: {e}")
+                self.failed += len(batch)
+                self.healthy = False
+            self.batches += 1
+        session.close()
+
+    def close(self, timeout = 5):
+        # Flushes everything queued so far - or as much as gets through within `timeout` seconds
+        deadline = time.monotonic() + timeout
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            # The worker is stuck on the emulator - what's still queued won't make it
+            self.drop_queued()
+            try:
+                self.queue.put_nowait(None)
+            except queue.Full:
+                pass
+        self.thread.join(max(deadline - time.monotonic(), 0))
+
+    def drop_queued(self):
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+            self.dropped += 1
+
+def open_sender(address, fallback_address = EMULATOR_URL, **kwargs):
+    # "shm://<name>" - the emulator's shared memory ring (see shmring), when the emulator runs on this
+    # host. Falls back to HTTP at `fallback_address` if the ring isn't there.
+    # Anything else is an HTTP address. kwargs go to EmulatorSender.
+    if address.startswith('shm://'):
+        try:
+            from .shmring import ShmSender, DEFAULT_NAME
+            return ShmSender(address[len('shm://'):] or DEFAULT_NAME)
+        except (ImportError, OSError, ValueError) as e:
+            print(f"[Emulator]: No shared memory ring at {address} ({e}), sending to {fallback_address}")
+            address = fallback_address
+    return EmulatorSender(address, **kwargs)
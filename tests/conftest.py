@@ -0,0 +1,5 @@
+import sys
+import os
+
+# The package isn't installed - make it importable however the tests are started
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,62 @@
+import random
+
+from sony_himd_display.capdiff import Unit, matching_blocks, hunks, compare
+
+def lcs_length(a, b):
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+def sequences(count = 300):
+    rng = random.Random(1)
+    yield [], []
+    yield [1, 2, 3], []
+    yield [], [1, 2, 3]
+    yield [1, 2, 3], [1, 2, 3]
+    for _ in range(count):
+        alphabet = rng.randint(1, 5)
+        a = [rng.randrange(alphabet) for _ in range(rng.randint(0, 30))]
+        # Mostly similar, the way two captures of the same session are
+        b = [x for x in a if rng.random() > 0.2]
+        for _ in range(rng.randint(0, 5)):
+            b.insert(rng.randint(0, len(b)), rng.randrange(alphabet))
+        yield a, b
+
+def test_matching_blocks_are_a_longest_common_subsequence():
+    for a, b in sequences():
+        blocks = matching_blocks(a, b)
+        i = j = 0
+        for x, y, length in blocks:
+            assert length > 0
+            assert x >= i and y >= j
+            assert a[x:x + length] == b[y:y + length]
+            i, j = x + length, y + length
+        assert sum(x[2] for x in blocks) == lcs_length(a, b)
+
+def test_hunks_turn_a_into_b():
+    for a, b in sequences():
+        result = list(a)
+        # From the back, so that the earlier positions still apply
+        for a_start, a_end, b_start, b_end in reversed(list(hunks(a, b))):
+            result[a_start:a_end] = b[b_start:b_end]
+        assert result == b
+
+def unit(opcode, data, start):
+    return Unit([opcode], start, start + len(data), data)
+
+def test_compare_counts_per_opcode():
+    heartbeat, glyph, clock = b'\x02\x81', b'\x1b\x03', b'\xe2\x20\x00\x01\x05C'
+    title, other = b'\xe0\x01\x01\x05A', b'\xe0\x01\x01\x05B'
+    units_a = [unit(data[0], data, i * 10) for i, data in enumerate([heartbeat, title, heartbeat, clock, heartbeat])]
+    units_b = [unit(data[0], data, i * 10) for i, data in enumerate([heartbeat, other, heartbeat, glyph, clock, heartbeat])]
+    changes, by_opcode = compare(units_a, units_b)
+    assert changes == [(1, 2, 1, 2), (3, 3, 3, 4)]
+    assert set(by_opcode) == {0xE0, 0x1B}
+    assert (by_opcode[0xE0].only_a, by_opcode[0xE0].only_b) == (1, 1)
+    assert (by_opcode[0xE0].first_a, by_opcode[0xE0].first_b) == (10, 10)
+    assert (by_opcode[0x1B].only_a, by_opcode[0x1B].only_b) == (0, 1)
+    assert by_opcode[0x1B].first_a is None and by_opcode[0x1B].first_b == 30
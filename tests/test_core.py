@@ -0,0 +1,54 @@
+from functools import reduce
+import operator
+
+from sony_himd_display import synth
+from sony_himd_display.core import decode_stream, AnnotationType
+
+def raw_packet(body, corrupt = False):
+    # Like synth.packet(), without checking that the commands fit
+    body = body.ljust(synth.PAYLOAD_LENGTH, b'\0')
+    checksum = reduce(operator.xor, body, 0) ^ 0xFF
+    return body + bytes([checksum ^ int(corrupt)])
+
+def edge_cases():
+    text = synth.text_command(0, b'Ends on the last byte', 'latin1')
+    yield synth.prologue()
+    # The command ends on the last payload byte, right before the checksum
+    filler = synth.PAYLOAD_LENGTH - len(text)
+    assert filler % len(synth.heartbeat()) == 0
+    yield raw_packet(synth.heartbeat() * (filler // len(synth.heartbeat())) + text)
+    yield synth.prologue(0x3F)
+    # An E0 whose text runs past the end of the packet
+    yield raw_packet(bytes([0xE0, 0x02, 0x30, 0x05]) + b'Too long')
+    yield synth.prologue()
+    yield raw_packet(bytes([0xE0, 0x04, 0x30, 0x05]) + b'Too long, corrupt', corrupt = True)
+
+def in_order(annotations):
+    # The packet parser puts the ASCII row of a packet before its commands, the byte parser
+    # interleaves them
+    return sorted(annotations, key=lambda x: (x[0], x[1], x[2], repr(x[3])))
+
+def decode(data, packet_mode):
+    annotations = []
+    records = list(decode_stream(
+        synth.iter_samples(data), packet_mode = packet_mode, describe = True,
+        annotate = lambda *x: annotations.append(x),
+    ))
+    return records, annotations
+
+def test_packet_and_byte_parsers_agree():
+    data = b''.join(edge_cases()) + synth.SessionGenerator(seed = 3, corrupt_rate = 0.05).capture(2000) + b''.join(edge_cases())
+    packet_records, packet_annotations = decode(data, True)
+    byte_records, byte_annotations = decode(data, False)
+    assert [x.to_dict() for x in packet_records] == [x.to_dict() for x in byte_records]
+    assert in_order(packet_annotations) == in_order(byte_annotations)
+    assert any(not x.checksum_ok for x in packet_records)
+
+def test_text_length_edge_cases():
+    records, annotations = decode(b''.join(edge_cases()), True)
+    texts = [x.fields.get('text') for x in records if x.opcode == 0xE0]
+    assert texts == ['Ends on the last byte']
+    assert all(x.checksum_ok for x in records[:-1])
+    # The commands running past their packets are reported
+    errors = [x[3][0] for x in annotations if x[2] == AnnotationType.ERROR]
+    assert sum('remaining' in x for x in errors) == 2
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+QtWidgets = pytest.importorskip('PyQt5.QtWidgets')
+
+from sony_himd_display import emulator
+
+@pytest.fixture(scope='module')
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+def test_notifier_coalesces_until_acknowledged(app):
+    notifier = emulator.UpdateNotifier()
+    calls = []
+    notifier.changed.connect(lambda: calls.append(1))
+    notifier.notify()
+    notifier.notify()
+    notifier.notify()
+    assert calls == [1]
+    notifier.acknowledge()
+    notifier.notify()
+    assert calls == [1, 1]
+
+def test_notifier_without_receiver_stays_pending(app):
+    notifier = emulator.UpdateNotifier()
+    notifier.notify()
+    calls = []
+    notifier.changed.connect(lambda: calls.append(1))
+    # Swallowed until someone acknowledges the notification nobody received
+    notifier.notify()
+    assert calls == []
+    notifier.acknowledge()
+    notifier.notify()
+    assert calls == [1]
+
+def test_window_picks_up_notifications_sent_before_it_existed(app):
+    emulator.notifier.acknowledge()
+    emulator.notifier.notify()
+    window = emulator.MainWindow()
+    assert not emulator.notifier.pending
+    assert window.frame_timer.isActive()
+    window.frame_timer.stop()
+    emulator.notifier.notify()
+    assert window.frame_timer.isActive()
+    window.frame_timer.stop()
+    emulator.notifier.changed.disconnect(window.schedule_update)
+    emulator.notifier.acknowledge()
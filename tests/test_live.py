@@ -0,0 +1,112 @@
+import threading
+import socket
+import tty
+import os
+
+from sony_himd_display import synth
+from sony_himd_display.live import LiveDecoder, MessageRing, MESSAGE_LENGTH
+
+def message(commands, prologue = 0x3D, corrupt = False):
+    return synth.prologue(prologue) + synth.packet(commands, corrupt)
+
+MESSAGES = [
+    message([synth.text_command(0, b'First', 'latin1')]),
+    # The firmware skips 0x3B like the other prologues
+    message([synth.text_command(1, b'Second', 'latin1')], prologue = 0x3B),
+    message([synth.heartbeat()], prologue = 0xFF),
+    message([synth.text_command(2, b'Third', 'latin1')]),
+]
+EXPECTED = [('First', True), ('Second', True), (None, True), ('Third', True)]
+
+class Collector:
+    def __init__(self, count):
+        self.records = []
+        self.count = count
+        self.done = threading.Event()
+
+    def __call__(self, records):
+        self.records += records
+        if len(self.records) >= self.count:
+            self.done.set()
+
+    def summary(self):
+        return [(x.fields.get('text'), x.checksum_ok) for x in self.records]
+
+def test_ring_resynchronizes():
+    ring = MessageRing(slots = 8)
+    data = b'\x00\x01' + b''.join(MESSAGES)
+    buffer = ring.free()
+    buffer[:len(data)] = data
+    ring.received(len(data))
+    messages = [bytes(x) for x in ring.messages()]
+    assert messages[:2] == MESSAGES[:2]
+    assert ring.skipped == 2
+
+def test_corrupt_rows_dont_stop_decoding():
+    live = LiveDecoder('unused')
+    records = []
+    # Bit errors in the row bitfields - the handlers run before the checksum is checked
+    for commands in ([bytes([0xE0, 0x00, 0x01, 0x05]) + b'A'], [bytes([0xE2, 0x40, 0x00, 0x01, 0x05]) + b'B'], [bytes([0x69, 0x00, 1, 2, 1])], [bytes([0x1B, 0x09])]):
+        records += live.feed(message(commands, corrupt = True))
+    assert [(x.checksum_ok, bool(x.errors)) for x in records] == [(False, True)] * 4
+    records = []
+    for x in MESSAGES:
+        records += live.feed(x)
+    assert [(x.fields.get('text'), x.checksum_ok) for x in records] == EXPECTED
+    assert live.failed == 0
+
+def test_failed_message_resets_the_decoder():
+    live = LiveDecoder('unused')
+    feed = live.core.feed
+    fed = []
+    def failing(start, end, value):
+        # Half way into the data packet
+        fed.append(value)
+        if len(fed) == 20:
+            raise ValueError("Broken handler")
+        return feed(start, end, value)
+    live.core.feed = failing
+    assert live.feed(MESSAGES[0]) == []
+    assert live.failed == 1
+    live.core.feed = feed
+    records = []
+    for x in MESSAGES[1:]:
+        records += live.feed(x)
+    assert [(x.fields.get('text'), x.checksum_ok) for x in records] == EXPECTED[1:]
+
+def test_pty():
+    master, slave = os.openpty()
+    # Raw from the start - the decoder only sets it once it has opened the pty
+    tty.setraw(slave)
+    collector = Collector(len(EXPECTED))
+    live = LiveDecoder(os.ttyname(slave), handle_records = collector)
+    thread = live.start()
+    try:
+        # Split across writes, so that messages arrive in pieces
+        data = b''.join(MESSAGES)
+        for i in range(0, len(data), 17):
+            os.write(master, data[i:i + 17])
+        assert collector.done.wait(5)
+    finally:
+        os.close(master)
+        os.close(slave)
+        thread.join(5)
+    assert collector.summary() == EXPECTED
+    assert live.messages == len(MESSAGES)
+    assert live.ring.skipped == 0
+
+def test_socket():
+    listener = socket.create_server(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    collector = Collector(4)
+    live = LiveDecoder(f'tcp://127.0.0.1:{port}', handle_records = collector)
+    thread = live.start()
+    connection, _ = listener.accept()
+    with connection, listener:
+        # A lost byte - the ring skips to the next prologue
+        connection.sendall(b''.join(MESSAGES[:2]) + MESSAGES[2][1:] + MESSAGES[3] + message([synth.heartbeat()], corrupt = True))
+        assert collector.done.wait(5)
+    thread.join(5)
+    assert collector.summary() == [('First', True), ('Second', True), ('Third', True), (None, False)]
+    assert live.messages == 4
+    assert live.ring.skipped == MESSAGE_LENGTH - 1
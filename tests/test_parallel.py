@@ -0,0 +1,42 @@
+import pytest
+
+from sony_himd_display import synth
+from sony_himd_display.core import decode_file, AnnotationType, ALL_ANNOTATION_TYPES
+from sony_himd_display.parallel import ParallelDecoder, split_points
+
+# The statistics cover a whole capture, and every chunk would start with a blank screen
+COMPARED_TYPES = tuple(set(ALL_ANNOTATION_TYPES) - {AnnotationType.STATS, AnnotationType.SCREEN})
+
+@pytest.fixture(scope='module')
+def capture(tmp_path_factory):
+    path = tmp_path_factory.mktemp('parallel') / 'capture.bin'
+    generator = synth.SessionGenerator(seed = 7, corrupt_rate = 0.02)
+    path.write_bytes(generator.capture(3000))
+    return str(path)
+
+def sequential(path, **options):
+    annotations = []
+    records = list(decode_file(path, annotate = lambda *x: annotations.append(x), annotation_types = COMPARED_TYPES, describe = True, **options))
+    return records, annotations
+
+def parallel(path, jobs, **options):
+    annotations = []
+    decoder = ParallelDecoder(annotate = lambda *x: annotations.append(x), jobs = jobs, chunk_size = 5000, annotation_types = COMPARED_TYPES, describe = True, **options)
+    records = list(decoder.decode_file(path))
+    return records, annotations
+
+# Repeats are only collapsed by the packet parser
+@pytest.mark.parametrize('packet_mode, collapse_repeats', [(True, False), (True, True), (False, False)])
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_same_as_a_single_decoder(capture, packet_mode, collapse_repeats, jobs):
+    options = dict(packet_mode = packet_mode, collapse_repeats = collapse_repeats)
+    expected_records, expected_annotations = sequential(capture, **options)
+    records, annotations = parallel(capture, jobs, **options)
+    assert [x.to_dict() for x in records] == [x.to_dict() for x in expected_records]
+    assert annotations == expected_annotations
+
+def test_runs_of_repeats_are_not_split():
+    data = b''.join(synth.prologue() + synth.packet([synth.heartbeat()]) for _ in range(200))
+    # Every packet is a repeat of the previous one - there's nowhere to cut
+    assert split_points(data, 500, collapse_repeats = True) == [0]
+    assert len(split_points(data, 500)) > 10
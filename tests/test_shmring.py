@@ -0,0 +1,63 @@
+import subprocess
+import sys
+import os
+
+import pytest
+
+from sony_himd_display.shmring import ShmReceiver, HEADER
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def name():
+    return f'rh10-test-{os.getpid()}'
+
+def run(code):
+    # In another process, like the decoder (or a second emulator) would be - the resource tracker
+    # keeps one registration per name and process
+    result = subprocess.run(
+        [sys.executable, '-c', 'from sony_himd_display.shmring import *\n' + code],
+        cwd=ROOT, capture_output=True, text=True, timeout=30,
+    )
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+def send(name, events):
+    run(f'sender = ShmSender({name!r})\nfor event in {events!r}:\n    sender.send(event)\nsender.close()')
+
+def test_events_round_trip(name):
+    receiver = ShmReceiver(None, name, capacity = 4096)
+    try:
+        events = [{"type": "init"}, {"type": "clear", "rows": [1, 2]}]
+        send(name, events)
+        assert receiver.receive() == events
+    finally:
+        receiver.close()
+
+def test_running_emulator_keeps_its_segment(name):
+    receiver = ShmReceiver(None, name, capacity = 4096)
+    try:
+        output = run(f'try:\n    ShmReceiver(None, {name!r})\nexcept FileExistsError as e:\n    print(e)')
+        assert str(os.getpid()) in output
+        # Still the first one's
+        send(name, [{"type": "init"}])
+        assert receiver.receive() == [{"type": "init"}]
+    finally:
+        receiver.close()
+
+def test_stale_segment_is_replaced(name):
+    # As if a crashed emulator had left it behind
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    run(f'from multiprocessing import shared_memory, resource_tracker\n'
+        f'segment = shared_memory.SharedMemory({name!r}, create=True, size=DATA_OFFSET + 4096)\n'
+        f'resource_tracker.unregister(segment._name, "shared_memory")\n'
+        f'HEADER.pack_into(segment.buf, 0, MAGIC, 4096, {process.pid})\n'
+        f'segment.close()')
+    receiver = ShmReceiver(None, name, capacity = 4096)
+    try:
+        assert HEADER.unpack_from(receiver.buffer)[2] == os.getpid()
+        send(name, [{"type": "init"}])
+        assert receiver.receive() == [{"type": "init"}]
+    finally:
+        receiver.close()
@@ -0,0 +1,55 @@
+from sony_himd_display import synth
+from sony_himd_display.core import PROLOGUE_LENGTH, PACKET_LENGTH
+from sony_himd_display.textindex import build_index
+
+MESSAGE_LENGTH = PROLOGUE_LENGTH + PACKET_LENGTH
+
+def write_capture(path, packets):
+    # One prologue + data packet per list of commands - message i starts at sample i * MESSAGE_LENGTH
+    with open(path, 'wb') as f:
+        for commands in packets:
+            f.write(synth.prologue())
+            f.write(synth.packet(commands))
+
+def message_start(i):
+    return i * MESSAGE_LENGTH
+
+def shown(index, sample):
+    return {x.row: x.text for x in index.at(sample)}
+
+def test_at_follows_clears_and_overwrites(tmp_path):
+    capture = str(tmp_path / 'capture.bin')
+    write_capture(capture, [
+        [synth.text_command(0, b'Title', 'latin1'), synth.text_command(5, b'12:00', 'latin1')],
+        [synth.heartbeat()],
+        [synth.text_command(0, b'Title', 'latin1')],
+        [synth.clear_rows([0])],
+        [synth.heartbeat()],
+        [synth.text_command(0, b'Other', 'latin1')],
+        [synth.text_command(0, b'Title', 'latin1')],
+    ])
+    index = build_index(capture, str(tmp_path / 'capture.textidx'))
+
+    assert shown(index, message_start(0) + 30) == {0: 'Title', 5: '12:00'}
+    # Shown between the redraws as well
+    assert shown(index, message_start(1) + 10) == {0: 'Title', 5: '12:00'}
+    assert shown(index, message_start(4) + 10) == {5: '12:00'}
+    assert shown(index, message_start(5) + 10) == {0: 'Other', 5: '12:00'}
+
+    title = index.find('Title', exact=True)
+    assert [x.writes for x in title] == [2, 1]
+    # The first one ends at the clear
+    assert message_start(3) < title[0].end < message_start(4)
+    index.close()
+
+def test_other_opcode_replaces_the_row(tmp_path):
+    capture = str(tmp_path / 'capture.bin')
+    write_capture(capture, [
+        [synth.text_command(2, b'Menu', 'latin1')],
+        [synth.special_text_command(2, b'Menu', 'latin1')],
+        [synth.heartbeat()],
+    ])
+    index = build_index(capture, str(tmp_path / 'capture.textidx'))
+    occurrences = index.at(message_start(2))
+    assert [(x.opcode, x.text) for x in occurrences] == [(0xE2, 'Menu')]
+    index.close()
@@ -0,0 +1,28 @@
+import socket
+import time
+
+import pytest
+
+pytest.importorskip('requests')
+
+from sony_himd_display.transport import EmulatorSender
+
+@pytest.fixture
+def silent_emulator():
+    # Accepts connections (the kernel does, from the backlog) but never answers
+    listener = socket.create_server(('127.0.0.1', 0), backlog=16)
+    yield f'http://127.0.0.1:{listener.getsockname()[1]}'
+    listener.close()
+
+def test_silent_emulator_doesnt_stall_the_decoder(silent_emulator):
+    sender = EmulatorSender(silent_emulator, queue_length = 8, batch_size = 4, request_timeout = 0.2, max_wait = 0.5)
+    start = time.monotonic()
+    for i in range(200):
+        sender.send({"type": "glyph", "glyph": "revp"})
+    assert time.monotonic() - start < 2
+    assert sender.dropped > 0
+    assert not sender.healthy
+
+    start = time.monotonic()
+    sender.close(timeout = 1)
+    assert time.monotonic() - start < 1.5